@@ -0,0 +1,334 @@
+"""Spikes, dips and level shifts in daily series, and the report's insights.
+
+A scan takes a matrix with one row per series and one column per day, so the
+series of every country × app segment are scanned together, each step an
+array operation over all rows. For every day of every series:
+
+- the *baseline* is the mean of the same weekday over the previous
+  ``JUSTDICE_ANOMALY_WINDOW`` days (default 28), so the weekly pattern is
+  not flagged;
+- the *scale* is the standard deviation of the residuals (value minus
+  baseline) over the previous window, at least 10% of the window's mean;
+- ``z`` is the residual over the scale. A day with ``|z|`` of at least
+  ``JUSTDICE_ANOMALY_Z`` (default 3) is a spike or a dip. In a scan of many
+  segments it must also move at least 1% of their summed level, so noise in
+  tiny segments is not reported. Days of a series that had values on fewer
+  than half of the previous window's days are not scored;
+- a two-sided CUSUM of ``z`` (clipped at ``±JUSTDICE_ANOMALY_Z``, slack 0.5,
+  threshold 5) detects sustained shifts: a *change* starts on the day its
+  sum left 0 and is detected on the day it crossed the threshold.
+
+The first two windows of a series are its warm-up and are never flagged.
+Every statistic of a day depends only on that day and the days before it,
+so when the data changes a scan resumes from the first day whose values
+differ, from the CUSUM state stored for the day before; appending new days
+only scans the new days.
+"""
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import slicer
+
+WINDOW = int(os.environ.get("JUSTDICE_ANOMALY_WINDOW", "28")) // 7 * 7
+Z = float(os.environ.get("JUSTDICE_ANOMALY_Z", "3"))
+SCALE_FLOOR = 0.1
+MIN_SHARE = 0.01
+ACTIVE_SHARE = 0.5
+CUSUM_SLACK = 0.5
+CUSUM_LIMIT = 5.0
+
+# Cube measures making up each daily series, with their signs.
+SERIES = {
+    "ads_spend": {"ads_spend": 1},
+    "installs": {"installs": 1},
+    "payouts": {"payouts": 1},
+    "revenue": {"revenue": 1},
+    "profit": {"revenue": 1, "payouts": -1, "ads_spend": -1},
+}
+LABELS = {"ads_spend": "ads spend", "installs": "installs", "payouts": "payouts", "revenue": "revenue", "profit": "profit"}
+
+_last = {}  # name -> the latest segment Scan, resumed by the next one
+_lock = threading.Lock()
+
+
+def _trailing_mean(a):
+    # Mean of the previous WINDOW columns of each column; NaN unless all of them are numbers.
+    valid = ~np.isnan(a)
+    sums = np.zeros((a.shape[0], a.shape[1] + 1))
+    counts = np.zeros((a.shape[0], a.shape[1] + 1))
+    np.cumsum(np.where(valid, a, 0), axis=1, out=sums[:, 1:])
+    np.cumsum(valid, axis=1, out=counts[:, 1:])
+    mean = np.full(a.shape, np.nan)
+    if a.shape[1] > WINDOW:
+        window = counts[:, WINDOW:-1] - counts[:, :-WINDOW - 1]
+        total = sums[:, WINDOW:-1] - sums[:, :-WINDOW - 1]
+        mean[:, WINDOW:] = np.where(window == WINDOW, total / WINDOW, np.nan)
+    return mean
+
+
+def statistics(values, first: int = 0):
+    """(baseline, level, z) of the columns of ``values`` from ``first`` on; ``level`` is the trailing mean."""
+    # Two windows of history are enough for the statistics of a column.
+    start = max(0, first - 2 * WINDOW)
+    x = values[:, start:]
+    baseline = np.full(x.shape, np.nan)
+    if x.shape[1] > WINDOW:
+        weeks = WINDOW // 7
+        baseline[:, WINDOW:] = sum(x[:, WINDOW - 7 * k:x.shape[1] - 7 * k] for k in range(1, weeks + 1)) / weeks
+    residual = x - baseline
+    level = _trailing_mean(x)
+    spread = np.sqrt(np.maximum(_trailing_mean(residual ** 2) - _trailing_mean(residual) ** 2, 0))
+    scale = np.maximum(spread, SCALE_FLOOR * np.abs(level))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = residual / scale
+    # Series with values on fewer than half of the window's days are too sparse to score.
+    z[~(_trailing_mean((x != 0).astype(np.float64)) >= ACTIVE_SHARE)] = np.nan
+    cut = first - start
+    return baseline[:, cut:], level[:, cut:], z[:, cut:]
+
+
+class Scan:
+    """Anomalies and changes of every row of ``values`` (rows labelled by ``labels``, columns by ``dates``).
+
+    With ``previous``, a scan of an earlier version of the same series, only
+    the days from the first changed one are scanned again.
+    """
+
+    def __init__(self, labels: pd.DataFrame, values, dates, previous=None):
+        self.labels = labels.reset_index(drop=True)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.dates = pd.DatetimeIndex(dates)
+        rows, days = self.values.shape
+        # CUSUM state after each day: the positive and negative sums and the day each run started.
+        self.cusum = np.zeros((2, rows, days))
+        self.run_start = np.zeros((2, rows, days), dtype=np.int32)
+        first, flagged, alarms = 0, [], []
+        if previous is not None:
+            first, flagged, alarms = self._resume(previous)
+        self.scanned = days - first  # days scanned by this scan
+
+        baseline, level, z = statistics(self.values, first)
+        reference = statistics(self.values.sum(axis=0, keepdims=True), first)[1]
+        residual = self.values[:, first:] - baseline
+        material = np.abs(residual) >= MIN_SHARE * np.abs(reference) if rows > 1 else True
+        row, day = np.nonzero((np.abs(z) >= Z) & material)
+        flagged.append(pd.DataFrame({"row": row, "day": day + first, "value": self.values[row, day + first],
+                                     "baseline": baseline[row, day], "z": z[row, day]}))
+        alarms.append(self._cusum(z, first))
+        self._anomalies = pd.concat(flagged, ignore_index=True)
+        self._alarms = pd.concat(alarms, ignore_index=True)
+
+    @property
+    def nbytes(self):
+        frames = [self.labels, self._anomalies, self._alarms]
+        return self.values.nbytes + self.cusum.nbytes + self.run_start.nbytes + \
+            sum(int(df.memory_usage(index=True).sum()) for df in frames)
+
+    def _resume(self, previous):
+        # First day whose values differ from `previous`, with its results before that day; rows missing from
+        # `previous` count as zero, which is what they were.
+        if len(previous.dates) == 0 or len(self.dates) == 0 or previous.dates[0] != self.dates[0] \
+                or list(previous.labels.columns) != list(self.labels.columns):
+            return 0, [], []
+        old_rows = pd.MultiIndex.from_frame(previous.labels) if len(self.labels.columns) else pd.RangeIndex(len(previous.labels))
+        new_rows = pd.MultiIndex.from_frame(self.labels) if len(self.labels.columns) else pd.RangeIndex(len(self.labels))
+        position = old_rows.get_indexer(new_rows)  # row of each new row in `previous`, -1 if none
+        kept = position >= 0
+        days = min(len(previous.dates), len(self.dates))
+        old = np.zeros((len(self.labels), days))
+        old[kept] = previous.values[position[kept], :days]
+        differs = (old != self.values[:, :days]).any(axis=0)
+        first = int(differs.argmax()) if differs.any() else days
+        if first == 0:
+            return 0, [], []
+        self.cusum[:, kept, :first] = previous.cusum[:, position[kept], :first]
+        self.run_start[:, kept, :first] = previous.run_start[:, position[kept], :first]
+        renumber = pd.Series(np.flatnonzero(kept), index=position[kept])
+
+        def carry(df, column):
+            df = df[(df[column] < first) & df["row"].isin(renumber.index)].copy()
+            df["row"] = renumber.loc[df["row"]].to_numpy()
+            return df
+
+        return first, [carry(previous._anomalies, "day")], [carry(previous._alarms, "detected")]
+
+    def _cusum(self, z, first: int):
+        # Two-sided CUSUM over the days from `first`, all rows at once. Returns the alarms.
+        z = np.clip(np.nan_to_num(z, nan=0.0, posinf=Z, neginf=-Z), -Z, Z)
+        rows = z.shape[0]
+        sums = self.cusum[:, :, first - 1].copy() if first else np.zeros((2, rows))
+        starts = self.run_start[:, :, first - 1].copy() if first else np.zeros((2, rows), dtype=np.int32)
+        alarms = []
+        for j in range(z.shape[1]):
+            day = first + j
+            updated = np.maximum(0, sums + np.stack([z[:, j], -z[:, j]]) - CUSUM_SLACK)
+            starts = np.where((sums == 0) & (updated > 0), day, starts)
+            crossed = updated > CUSUM_LIMIT
+            if crossed.any():
+                side, row = np.nonzero(crossed)
+                alarms.append(pd.DataFrame({"row": row, "start": starts[side, row], "detected": day,
+                                            "direction": np.where(side == 0, 1, -1)}))
+                updated[crossed] = 0
+            sums = updated
+            self.cusum[:, :, day] = sums
+            self.run_start[:, :, day] = starts
+        columns = ["row", "start", "detected", "direction"]
+        return pd.concat(alarms, ignore_index=True) if alarms else pd.DataFrame({c: pd.Series(dtype=np.int64) for c in columns})
+
+    def anomalies(self):
+        """Flagged days: labels, event_date, value, baseline, z and kind ("spike" or "dip"), by date."""
+        df = self._anomalies.sort_values(["day", "row"], ignore_index=True)
+        result = self.labels.iloc[df["row"]].reset_index(drop=True)
+        result["event_date"] = self.dates[df["day"]]
+        result["value"], result["baseline"], result["z"] = df["value"].to_numpy(), df["baseline"].to_numpy(), df["z"].to_numpy()
+        result["kind"] = np.where(df["z"] > 0, "spike", "dip")
+        return result
+
+    def changes(self):
+        """Sustained shifts: labels, start, detected, direction ("up" or "down") and the mean daily value over the
+        window ``before`` the start and from the start to detection (``after``)."""
+        df = self._alarms.sort_values(["detected", "row"], ignore_index=True)
+        sums = np.zeros((len(self.values), self.values.shape[1] + 1))
+        np.cumsum(self.values, axis=1, out=sums[:, 1:])
+        row, start, end = df["row"].to_numpy(), df["start"].to_numpy(), df["detected"].to_numpy() + 1
+        begin = np.maximum(start - WINDOW, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            before = (sums[row, start] - sums[row, begin]) / (start - begin)
+            after = (sums[row, end] - sums[row, start]) / (end - start)
+        result = self.labels.iloc[row].reset_index(drop=True)
+        result["start"], result["detected"] = self.dates[start], self.dates[df["detected"]]
+        result["direction"] = np.where(df["direction"] > 0, "up", "down")
+        result["before"], result["after"] = before, after
+        return result
+
+
+def segment_matrix(index, name: str):
+    """(labels, values) of the daily ``name`` series of every country × app in the cube index, over index.dates()."""
+    apps = len(index.values['app_id'])
+    segment = index.codes['country_id'].astype(np.int64) * apps + index.codes['app_id']
+    rows, segment = np.unique(segment, return_inverse=True)
+    flat = segment * index.n_days + index.day
+    size = len(rows) * index.n_days
+    values = sum(sign * np.bincount(flat, weights=index.measures[measure], minlength=size)
+                 for measure, sign in SERIES[name].items())
+    labels = pd.DataFrame({"country_id": index.values['country_id'][rows // apps],
+                           "app_id": index.values['app_id'][rows % apps]})
+    return labels, np.asarray(values).reshape(len(rows), index.n_days)
+
+
+def scan_segments(index, name: str):
+    """Scan of every country × app series of ``name``, resumed from the previous scan of this process."""
+    labels, values = segment_matrix(index, name)
+    with _lock:
+        scan = Scan(labels, values, index.dates(), previous=_last.get(name))
+        _last[name] = scan
+    return scan
+
+
+def scan_series(series: pd.Series, dates):
+    """Scan of one daily series (indexed by event_date), with days missing from it counted as 0."""
+    values = series.reindex(pd.DatetimeIndex(dates), fill_value=0).to_numpy(dtype=np.float64)
+    return Scan(pd.DataFrame(index=[0]), values[None, :], dates)
+
+
+def _count(n: int, word: str):
+    return f"{n:,} {word}{'' if n == 1 else 's'}"
+
+
+def _join(items):
+    items = list(items)
+    return items[0] if len(items) == 1 else ", ".join(items[:-1]) + " and " + items[-1]
+
+
+def _in_range(dates, filters):
+    keep = np.ones(len(dates), dtype=bool)
+    if filters.start is not None:
+        keep &= np.asarray(dates >= filters.start)
+    if filters.end is not None:
+        keep &= np.asarray(dates <= filters.end)
+    return keep
+
+
+def select(flagged: pd.DataFrame, filters=None):
+    """The rows of segment ``anomalies()`` in the dates, countries and apps of ``filters``."""
+    filters = slicer.normalize(filters)
+    keep = _in_range(flagged['event_date'], filters)
+    if filters.countries:
+        keep &= flagged['country_id'].isin(filters.countries).to_numpy()
+    if filters.apps:
+        keep &= flagged['app_id'].isin(filters.apps).to_numpy()
+    return flagged[keep].reset_index(drop=True)
+
+
+def describe(name: str, series: pd.Series, scan: Scan, segments=None, filters=None):
+    """Markdown bullets (without the leading dash) on the daily ``name`` series of a selection.
+
+    ``series`` is the selection's series by event_date, ``scan`` its scan over
+    all dates and ``segments`` the scan of all country × app series; days
+    outside the date range of ``filters`` are not described.
+    """
+    filters = slicer.normalize(filters)
+    label = LABELS[name]
+    money = name != "installs"
+
+    def amount(value):
+        # "$" is escaped, Streamlit renders text between two of them as LaTeX.
+        return f"{'-' if value < 0 else ''}\\${abs(value):,.2f}" if money else f"{value:,.0f}"
+
+    series = series[_in_range(series.index, filters)]
+    if series.empty:
+        return [f"There {'are' if name == 'installs' else 'is'} no {label} in the selection."]
+    first, last = series.index.min(), series.index.max()
+    day = "%b %d" if first.year == last.year else "%b %d, %Y"
+    bullets = [
+        f"Daily {label} from {first.strftime(day)} to {last.strftime(day)} totals {amount(series.sum())} over "
+        f"{_count(len(series), 'day')}, {amount(series.mean())} a day on average, ranging from {amount(series.min())} "
+        f"on {series.idxmin().strftime(day)} to {amount(series.max())} on {series.idxmax().strftime(day)}."
+    ]
+
+    months = series.groupby(series.index.to_period('M')).mean().sort_values(ascending=False)
+    if len(months) >= 4:
+        top = _join(f"{month.strftime('%B')} ({amount(value)})" for month, value in months.iloc[:3].items())
+        bottom = _join(f"{month.strftime('%B')} ({amount(value)})" for month, value in months.iloc[::-1].iloc[:3].items())
+        bullets.append(f"By month, the average day was highest in {top} and lowest in {bottom}.")
+    if len(series) >= 14:
+        weekdays = series.groupby(series.index.day_name()).mean()
+        bullets.append(f"By weekday, the average day is highest on {weekdays.idxmax()}s ({amount(weekdays.max())}) "
+                       f"and lowest on {weekdays.idxmin()}s ({amount(weekdays.min())}).")
+
+    anomalies = scan.anomalies()
+    anomalies = anomalies[_in_range(anomalies['event_date'], filters)]
+    for kind, word in [("spike", "above"), ("dip", "below")]:
+        days = anomalies[anomalies['kind'] == kind]
+        if len(days):
+            days = days.reindex(days['z'].abs().sort_values(ascending=False).index).iloc[:3]
+            listed = _join(f"{row.event_date.strftime(day)} ({amount(row.value)} against {amount(row.baseline)})"
+                               for row in days.itertuples())
+            bullets.append(f"{kind.capitalize()}s {word} the weekday baseline: {listed}.")
+    if anomalies.empty:
+        bullets.append(f"No day is {Z:g} or more standard deviations away from its weekday baseline.")
+
+    changes = scan.changes()
+    changes = changes[_in_range(changes['start'], filters)]
+    if len(changes):
+        listed = _join(f"{row.direction} from {row.start.strftime(day)} ({amount(row.before)} to {amount(row.after)} a day)"
+                           for row in changes.iloc[-4:].itertuples())
+        bullets.append(f"The level of daily {label} shifted {listed}.")
+    else:
+        bullets.append(f"There is no sustained shift in the level of daily {label}.")
+
+    if segments is not None:
+        flagged = select(segments.anomalies(), filters)
+        if len(flagged):
+            deviation = flagged['value'] - flagged['baseline']
+            largest = flagged.loc[deviation.abs().sort_values(ascending=False).index[:3]]
+            listed = _join(f"country {row.country_id} / app {row.app_id} on {row.event_date.strftime(day)} "
+                           f"({'+' if row.value >= row.baseline else '-'}{amount(abs(row.value - row.baseline))} against its baseline)"
+                           for row in largest.itertuples())
+            spikes = int((flagged['kind'] == 'spike').sum())
+            bullets.append(f"Across the {len(segments.labels):,} country × app series (all networks), {_count(spikes, 'spike')} "
+                           f"and {_count(len(flagged) - spikes, 'dip')} were flagged; the largest were {listed}.")
+    return bullets
@@ -0,0 +1,65 @@
+"""Static assets of the report.
+
+    python assets.py [url]
+
+The header animation is loaded once per process from ``JUSTDICE_LOTTIE_URL``
+(default: the original lottiefiles.com asset), with a timeout of
+``JUSTDICE_FETCH_TIMEOUT`` seconds (default 2). If the request fails, times
+out or returns something that is not JSON, the Lottie file bundled in
+``assets/`` is used instead; an empty ``JUSTDICE_LOTTIE_URL`` skips the
+request altogether. If neither is available the report renders without the
+animation.
+
+Run as a script it downloads the animation from ``url`` (default: the
+original lottiefiles.com asset) and replaces the bundled copy with it. Until
+that has been done the bundled copy is a plain stand-in bar-chart animation.
+"""
+import functools
+import json
+import os
+import sys
+
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+LOTTIE_PATH = os.path.join(ASSET_DIR, "lottie_chart.json")
+LOTTIE_SOURCE = "https://assets2.lottiefiles.com/packages/lf20_49rdyysj.json"
+
+LOTTIE_URL = os.environ.get("JUSTDICE_LOTTIE_URL", LOTTIE_SOURCE)
+FETCH_TIMEOUT = float(os.environ.get("JUSTDICE_FETCH_TIMEOUT", "2"))
+
+
+def fetch_json(url: str, timeout: float = FETCH_TIMEOUT):
+    """GET ``url`` and decode it as JSON; None on any network or decoding error."""
+    import requests  # only needed when fetching, so an empty JUSTDICE_LOTTIE_URL never imports it
+
+    try:
+        r = requests.get(url, timeout=timeout)
+        r.raise_for_status()
+        return r.json()
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def read_json(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def lottie():
+    """The header animation: fetched from ``JUSTDICE_LOTTIE_URL`` if set and reachable, else the bundled copy."""
+    animation = fetch_json(LOTTIE_URL) if LOTTIE_URL else None
+    return animation if animation is not None else read_json(LOTTIE_PATH)
+
+
+if __name__ == "__main__":
+    url = sys.argv[1] if len(sys.argv) > 1 else LOTTIE_SOURCE
+    animation = fetch_json(url, timeout=30)
+    if animation is None:
+        sys.exit(f"could not download {url}")
+    os.makedirs(ASSET_DIR, exist_ok=True)
+    with open(LOTTIE_PATH, "w") as f:
+        json.dump(animation, f, separators=(",", ":"))
+    print(f"{url} -> {LOTTIE_PATH}")
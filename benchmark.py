@@ -0,0 +1,229 @@
+"""Stage-by-stage benchmark of the report pipeline on synthetic data.
+
+    python benchmark.py [--scales 1,10,100] [--repeat 3] [--save-baseline] [--tolerance 0.25]
+
+For every scale, data of that multiple of the 2022 volume is generated once
+by synthetic.py (into ``--dir``, reused by later runs) and the pipeline is
+run ``--repeat`` times (default 3), each in a fresh interpreter with no
+Parquet files or caches left over, stage by stage: CSV parsing and typing per table (ingest.py; dates are converted
+while parsing), the cube build with its install attribution (cube.py), the
+cube index, every daily and segment rollup, unit economics, the cohort
+matrices, the distinct-install sketches (uniques.py), the anomaly scans of
+every country × app series (anomalies.py), the KPIs and the six daily line
+charts built and serialized as they are sent to the browser. Each stage
+records the median wall and CPU seconds of the runs (and the fastest wall
+time), the rows it produced and the process's peak RSS once it finished
+(worker processes included).
+
+Results are written as JSON to ``--out``. With ``--save-baseline`` the
+scales that were run replace theirs in the baseline
+(``benchmarks/baseline.json``), and other scales are kept; otherwise every
+stage is compared with the baseline, and the script exits with status 1
+when a stage of at least ``--min-seconds`` got slower by more than
+``--tolerance``, or when a scale has no baseline to compare with.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux; children are the cube build's worker processes.
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / 1024, 1)
+
+
+def stages():
+    """(name, function) of every stage, in pipeline order; each function returns a row count."""
+    import anomalies
+    import charts
+    import cube
+    import data
+    import ingest
+    import metrics
+
+    def ingest_stage(table):
+        return lambda: ingest.ingest([table]) and ingest.read_manifest()[table]["rows"]
+
+    def figures():
+        points = 0
+        for name, (function, column) in metrics.SERIES.items():
+            fig = charts.line(function(), x='event_date', y=column, title=name)
+            points += len(fig.data[0].x)
+            charts.spec(fig)
+        profit = metrics.daily_profit()
+        fig = charts.line(profit, x='event_date', y='daily_profit', title='profit')
+        charts.spec(fig)
+        return points + len(fig.data[0].x)
+
+    result = [(f"ingest.{table}", ingest_stage(table)) for table in ingest.TABLES]
+    result += [
+        ("cube.build", cube.build),
+        ("cube.index", lambda: len(data.cube_index().day)),
+    ]
+    result += [(f"daily.{name}", lambda function=function: len(function())) for name, (function, _) in metrics.SERIES.items()]
+    result += [
+        ("daily.profit", lambda: len(metrics.daily_profit())),
+        ("segments.country", lambda: len(data.installs_by_country())),
+        ("segments.app", lambda: len(data.installs_by_app())),
+        ("unit_economics", lambda: len(data.unit_economics())),
+        ("cohorts", lambda: int(data.install_cohorts()['installs']['installs'].sum())),
+        ("uniques", lambda: int(data.unique_installs()['installs'].iloc[0])),
+        ("anomalies", lambda: sum(data.segment_anomalies(name).values.size for name in anomalies.SERIES)),
+        ("kpis", lambda: len(metrics.kpis())),
+        ("figures", figures),
+    ]
+    return result
+
+
+def run_stages():
+    """Time every stage in this process; returns {stage: measurements}."""
+    results = {}
+    for name, function in stages():
+        wall, cpu = time.perf_counter(), time.process_time()
+        rows = function()
+        results[name] = {
+            "seconds": round(time.perf_counter() - wall, 4),
+            "cpu_seconds": round(time.process_time() - cpu, 4),
+            "rows": int(rows or 0),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    return results
+
+
+def run_scale(scale: float, directory: str, seed: int = 0, repeat: int = 3):
+    """Generate (once) and benchmark the data of one scale ``repeat`` times, each in a fresh interpreter."""
+    data_dir = os.path.join(directory, f"scale-{scale:g}-seed-{seed}")
+    marker = os.path.join(data_dir, "rows.json")
+    if not os.path.exists(marker):
+        # Generated in its own interpreter too, so that its memory does not count towards the stages' peak.
+        code = f"import json, synthetic; json.dump(synthetic.generate({data_dir!r}, {scale!r}, {seed!r}), open({marker!r}, 'w'))"
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+    with open(marker) as f:
+        rows = json.load(f)
+    env = dict(os.environ, JUSTDICE_DATA_DIR=data_dir)
+    env.pop("JUSTDICE_PARQUET_DIR", None)
+    env.pop("JUSTDICE_DAILY_DIR", None)
+    runs = []
+    for _ in range(repeat):
+        shutil.rmtree(os.path.join(data_dir, "parquet"), ignore_errors=True)
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-stages"], env=env, cwd=ROOT,
+                             capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    return {"input_rows": rows, "runs": repeat, "stages": summarize(runs)}
+
+
+def summarize(runs):
+    """Median seconds and CPU seconds of every stage over ``runs`` (lists of run_stages() results)."""
+    stages = {}
+    for stage in runs[0]:
+        measured = [run[stage] for run in runs]
+        stages[stage] = {
+            "seconds": round(statistics.median(m["seconds"] for m in measured), 4),
+            "best_seconds": min(m["seconds"] for m in measured),
+            "cpu_seconds": round(statistics.median(m["cpu_seconds"] for m in measured), 4),
+            "rows": measured[-1]["rows"],
+            "peak_rss_mb": max(m["peak_rss_mb"] for m in measured),
+        }
+    return stages
+
+
+def machine():
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "workers": os.environ.get("JUSTDICE_WORKERS", "default")}
+
+
+def missing(results, baseline):
+    """(scale, stage) of every result the baseline has nothing to compare with; stage is None for a whole scale."""
+    absent = []
+    for scale, result in results["scales"].items():
+        stages = baseline.get("scales", {}).get(scale, {}).get("stages")
+        if stages is None:
+            absent.append((scale, None))
+        else:
+            absent += [(scale, stage) for stage in result["stages"] if stage not in stages]
+    return absent
+
+
+def regressions(results, baseline, tolerance: float, min_seconds: float):
+    """(scale, stage, baseline seconds, seconds) of every stage slower than the baseline allows."""
+    slower = []
+    for scale, result in results["scales"].items():
+        for stage, measured in result["stages"].items():
+            base = baseline.get("scales", {}).get(scale, {}).get("stages", {}).get(stage)
+            if base is None or base["seconds"] < min_seconds:
+                continue  # reported by missing()
+            if measured["seconds"] > base["seconds"] * (1 + tolerance):
+                slower.append((scale, stage, base["seconds"], measured["seconds"]))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scales", default="1", help="comma-separated multiples of the 2022 volume")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dir", default=os.path.join(tempfile.gettempdir(), "justdice-benchmark"),
+                        help="where generated data is kept")
+    parser.add_argument("--out", default="benchmark.json", help="where the results are written")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scale; stages report the median")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results of the scales run in the baseline, keeping the others")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown per stage (0.25 = 25%%)")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="stages faster than this are not compared")
+    parser.add_argument("--run-stages", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_stages:
+        print("\n" + json.dumps(run_stages()))
+        return 0
+
+    results = {"machine": machine(), "scales": {}}
+    for scale in [float(s) for s in args.scales.split(",")]:
+        result = run_scale(scale, args.dir, args.seed, args.repeat)
+        results["scales"][f"{scale:g}"] = result
+        print(f"scale {scale:g} (median of {args.repeat}): "
+              + ", ".join(f"{t} {n:,}" for t, n in result["input_rows"].items()))
+        for stage, m in result["stages"].items():
+            print(f"  {stage:<18} {m['seconds']:9.3f}s  cpu {m['cpu_seconds']:9.3f}s  "
+                  f"rows {m['rows']:>12,}  peak {m['peak_rss_mb']:8.1f} MB")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.save_baseline:
+        # Scales that were not run keep their baseline.
+        results = {"machine": results["machine"], "scales": {**baseline.get("scales", {}), **results["scales"]}}
+    path = args.baseline if args.save_baseline else args.out
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"results -> {path}")
+    if args.save_baseline:
+        return 0
+
+    absent = missing(results, baseline)
+    for scale, stage in absent:
+        what = f"scale {scale}" if stage is None else f"scale {scale} {stage}"
+        print(f"NO BASELINE {what}: not compared; run with --save-baseline to record it", file=sys.stderr)
+    slower = regressions(results, baseline, args.tolerance, args.min_seconds)
+    for scale, stage, before, after in slower:
+        print(f"REGRESSION scale {scale} {stage}: {before:.3f}s -> {after:.3f}s")
+    return 1 if slower or any(stage is None for _, stage in absent) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""Plotly figures for long time series: downsampled, WebGL when dense, cached.
+
+Series longer than ``JUSTDICE_MAX_POINTS`` (default 2000) are reduced to
+about that many points before they are plotted, so the figure sent to the
+browser stays the same size however much history there is. The default
+method, Largest-Triangle-Three-Buckets (``JUSTDICE_DOWNSAMPLE=lttb``), keeps
+the points that shape the line, peaks and dips included; ``minmax`` keeps
+the lowest and highest point of every bucket instead. Traces that still
+have more than ``JUSTDICE_WEBGL_POINTS`` (default 1000) points are drawn
+with WebGL.
+
+``figure()`` memoizes the JSON spec of a built figure per cube version and
+filter state in the data cache (see data.py), and ``plotly_chart()`` sends
+that spec as it is. ``st.plotly_chart`` would validate and serialize the
+figure again on every rerun; with the cached spec a rerun with unchanged
+data and filters costs neither, and the spec is identical to the one the
+browser already has, which Streamlit's message cache does not send again.
+"""
+import json
+import os
+
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.utils
+
+import data
+
+MAX_POINTS = int(os.environ.get("JUSTDICE_MAX_POINTS", "2000"))
+WEBGL_POINTS = int(os.environ.get("JUSTDICE_WEBGL_POINTS", "1000"))
+METHOD = os.environ.get("JUSTDICE_DOWNSAMPLE", "lttb")
+
+
+def _numeric(x):
+    x = np.asarray(x)
+    return x.astype('datetime64[ns]').astype(np.int64).astype(np.float64) if x.dtype.kind == 'M' else x.astype(np.float64)
+
+
+def lttb(x, y, n: int):
+    """Indices of the ``n`` points of (x, y) picked by Largest-Triangle-Three-Buckets."""
+    size = len(y)
+    if n >= size or n < 3:
+        return np.arange(size)
+    x, y = _numeric(x), np.asarray(y, dtype=np.float64)
+    # The first and last points are kept; the rest is split into n - 2 buckets and one point is picked from each.
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    keep = np.empty(n, dtype=np.int64)
+    keep[0], keep[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        after = slice(hi, edges[i + 2] if i + 2 < len(edges) else size)
+        cx, cy = x[after].mean(), y[after].mean()
+        # Twice the area of the triangle (previous pick, candidate, mean of the next bucket).
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(area.argmax())
+        keep[i + 1] = a
+    return keep
+
+
+def minmax(x, y, n: int):
+    """Indices of the lowest and highest point of each of ``n // 2`` equal buckets, plus both ends."""
+    size = len(y)
+    if n >= size or n < 4:
+        return np.arange(size)
+    buckets = n // 2
+    bucket = np.arange(size) * buckets // size
+    order = np.lexsort((np.asarray(y), bucket))  # by bucket, then by value
+    starts = np.searchsorted(bucket, np.arange(buckets))
+    ends = np.append(starts[1:], size) - 1
+    return np.unique(np.concatenate([[0, size - 1], order[starts], order[ends]]))
+
+
+METHODS = {"lttb": lttb, "minmax": minmax}
+
+
+def downsample(x, y, n=None):
+    """Indices of at most about ``n`` (default MAX_POINTS) points of (x, y), in order."""
+    return METHODS[METHOD](x, y, MAX_POINTS if n is None else n)
+
+
+def line(df, x: str, y: str, **kwargs):
+    """``px.line`` of a downsampled ``df``."""
+    df = df.iloc[downsample(df[x], df[y])]
+    return px.line(df, x=x, y=y, render_mode='webgl' if len(df) > WEBGL_POINTS else 'svg', **kwargs)
+
+
+def scatter(x, y, **kwargs):
+    """A downsampled ``go.Scatter``, or ``go.Scattergl`` if it still has many points."""
+    x, y = np.asarray(x), np.asarray(y)
+    keep = downsample(x, y)
+    trace = go.Scattergl if len(keep) > WEBGL_POINTS else go.Scatter
+    return trace(x=x[keep], y=y[keep], **kwargs)
+
+
+def spec(fig):
+    """The JSON spec of ``fig``, serialized as ``st.plotly_chart`` does."""
+    return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def figure(name: str, filters, build):
+    """The spec() of ``build()``, memoized per cube version and ``filters``."""
+    return data.cached_view(f"figure[{name}]", filters, lambda: spec(build()))
+
+
+def plotly_chart(figure_spec: str):
+    """``st.plotly_chart`` of a spec from figure(), in the current container, without rebuilding the figure."""
+    import streamlit as st
+    from streamlit.proto.PlotlyChart_pb2 import PlotlyChart
+
+    # The message st.plotly_chart sends for a figure with its default arguments.
+    proto = PlotlyChart()
+    proto.use_container_width = False
+    proto.figure.spec = figure_spec
+    proto.figure.config = json.dumps({"showLink": False, "linkText": False})
+    proto.theme = "streamlit"
+    return st._main._enqueue("plotly_chart", proto)
@@ -0,0 +1,160 @@
+"""Install-cohort revenue and payout curves.
+
+Installs are grouped into cohorts by install date and into segments by
+(country_id, app_id). For every segment, cohort and install age of 0 to
+``MAX_AGE`` days the build accumulates the revenue and payouts of the
+cohort's installs, in one vectorized pass per chunk: the install day of each
+event is looked up by ``install_key`` and the age is the difference of two
+integer day numbers.
+
+Only cells that have events are kept, as long frames of daily amounts
+sorted by segment, cohort and age: most segments have no installs on most
+days and most cohorts earn nothing on most ages, so a dense segment x
+cohort x age matrix would be mostly zeros (and grows to gigabytes on large
+exports). curves() adds up the selected rows into cohort x age matrices and
+makes them cumulative along the age axis.
+
+Events before the install, later than ``MAX_AGE`` days after it, or of an
+unknown install are left out.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import stream
+
+MAX_AGE = int(os.environ.get("JUSTDICE_COHORT_DAYS", "90"))
+
+EVENT_COLUMNS = ["install_key", "event_date", "value_usd"]
+
+
+def day_numbers(dates):
+    """Days since 1970-01-01 of datetime64 values."""
+    return np.asarray(dates).astype('datetime64[D]').astype(np.int64)
+
+
+def _reduce(cells, values):
+    # Sum ``values`` per distinct cell; returns the sorted cells and their sums.
+    order = np.argsort(cells, kind="stable")
+    cells, values = cells[order], values[order]
+    starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]]) if len(cells) else np.zeros(0, dtype=np.int64)
+    return cells[starts], np.add.reduceat(values, starts) if len(starts) else values[:0]
+
+
+def build(chunk_mb=None):
+    """Cohort cells of the ingested tables, read from the same files as the cube.
+
+    Returns a dict with ``segments`` (a frame of country_id/app_id per
+    segment), ``cohorts`` (install dates), ``last_day`` (the latest event
+    date in the data), ``installs`` (a frame of segment, cohort and installs
+    per cell with installs) and ``revenue`` and ``payouts`` (frames of
+    segment, cohort, age and the value_usd of that day, per cell with
+    events). ``segment`` and ``cohort`` are positions in ``segments`` and
+    ``cohorts``.
+    """
+    installs = stream.read("installs", ["install_key", "event_date", "country_id", "app_id"])
+    keys = installs['install_key'].to_numpy()
+    install_day = day_numbers(installs['event_date'])
+    first_day = install_day.min() if len(install_day) else 0
+    n_cohorts = int(install_day.max(initial=first_day) - first_day + 1)
+    seg_codes, segments = pd.MultiIndex.from_frame(installs[['country_id', 'app_id']]).factorize()
+    segments = segments.set_names(['country_id', 'app_id'])
+    n_ages = MAX_AGE + 1
+
+    # Lookups from install_key to the install's cohort and segment; -1 for keys without an install.
+    cohort_of = np.full(keys.max(initial=-1) + 1, -1, dtype=np.int64)
+    cohort_of[keys] = install_day - first_day
+    segment_of = np.full(len(cohort_of), -1, dtype=np.int64)
+    segment_of[keys] = seg_codes
+    last_day = install_day.max(initial=first_day)
+
+    cells, counts = _reduce(seg_codes * n_cohorts + install_day - first_day, np.ones(len(keys), dtype=np.int64))
+    result = {
+        'segments': segments.to_frame(index=False),
+        'cohorts': pd.to_datetime(first_day + np.arange(n_cohorts), unit='D'),
+        'installs': pd.DataFrame({'segment': (cells // n_cohorts).astype(np.int32),
+                                  'cohort': (cells % n_cohorts).astype(np.int32), 'installs': counts}),
+    }
+    for table in ("revenue", "payouts"):
+        # Sums per chunk, reduced again whenever they outgrow the running total.
+        parts, size = [], 0
+        for chunk in stream.chunks(table, EVENT_COLUMNS, chunk_mb):
+            event_keys = chunk['install_key'].to_numpy()
+            event_day = day_numbers(chunk['event_date'])
+            last_day = max(last_day, event_day.max(initial=last_day))
+            known = (event_keys >= 0) & (event_keys < len(cohort_of))
+            event_keys, event_day, value = event_keys[known], event_day[known], chunk['value_usd'].to_numpy()[known]
+            cohort, segment = cohort_of[event_keys], segment_of[event_keys]
+            age = event_day - first_day - cohort
+            keep = (cohort >= 0) & (age >= 0) & (age <= MAX_AGE)
+            parts.append(_reduce((segment[keep] * n_cohorts + cohort[keep]) * n_ages + age[keep],
+                                 value[keep].astype(np.float64)))
+            if sum(len(part[0]) for part in parts) > 2 * size:
+                parts = [_reduce(*map(np.concatenate, zip(*parts)))]
+                size = len(parts[0][0])
+        cells, values = _reduce(*map(np.concatenate, zip(*parts))) if parts else (np.zeros(0, np.int64), np.zeros(0))
+        result[table] = pd.DataFrame({'segment': (cells // (n_cohorts * n_ages)).astype(np.int32),
+                                      'cohort': (cells // n_ages % n_cohorts).astype(np.int32),
+                                      'age': (cells % n_ages).astype(np.int16), 'value_usd': values})
+    result['last_day'] = pd.Timestamp(last_day, unit='D')
+    return result
+
+
+def curves(cohorts, countries=None, apps=None, freq=None, start=None, end=None):
+    """Cumulative revenue, payouts and net revenue per install by install age.
+
+    ``countries`` and ``apps`` restrict the segments (None for all). With
+    ``freq`` (e.g. ``'M'``) there is one curve per group of cohorts, indexed
+    by (cohort, age); otherwise all cohorts are pooled and the frame is
+    indexed by age. Only cohorts installed between ``start`` and ``end``
+    (inclusive, None for open) are used, and a cohort only counts towards an
+    age it has fully reached by ``last_day``, so young cohorts do not drag
+    curves down.
+    """
+    segments = cohorts['segments']
+    selected = np.ones(len(segments), dtype=bool)
+    if countries:
+        selected &= segments['country_id'].isin(countries).to_numpy()
+    if apps:
+        selected &= segments['app_id'].isin(apps).to_numpy()
+    dates = cohorts['cohorts']
+    ages = np.arange(MAX_AGE + 1)
+
+    def matrix(cells, value, shape):
+        # Sum of ``value`` per cohort (and age) over the cells of the selected segments.
+        cells = cells[selected[cells['segment'].to_numpy()]]
+        flat = cells['cohort'].to_numpy(np.int64)
+        if len(shape) > 1:
+            flat = flat * shape[1] + cells['age'].to_numpy()
+        return np.bincount(flat, weights=cells[value].to_numpy(np.float64), minlength=np.prod(shape)).reshape(shape)
+
+    installs = matrix(cohorts['installs'], 'installs', (len(dates),)).round().astype(np.int64)
+    revenue = matrix(cohorts['revenue'], 'value_usd', (len(dates), len(ages))).cumsum(axis=1)
+    payouts = matrix(cohorts['payouts'], 'value_usd', (len(dates), len(ages))).cumsum(axis=1)
+
+    # reached[c, a]: cohort c was at least a days old on the last day of data.
+    reached = (day_numbers(dates)[:, None] + ages[None, :]) <= day_numbers([cohorts['last_day']])[0]
+    if start is not None:
+        reached &= np.asarray(dates >= pd.Timestamp(start))[:, None]
+    if end is not None:
+        reached &= np.asarray(dates <= pd.Timestamp(end))[:, None]
+    groups = dates.to_period(freq).to_timestamp() if freq else np.zeros(len(dates), dtype=int)
+
+    def pooled(matrix):
+        return pd.DataFrame(matrix * reached, index=groups, columns=ages).groupby(level=0).sum()
+
+    base = pooled(np.broadcast_to(installs[:, None], reached.shape))
+    per_install = {name: pooled(matrix) / base.where(base > 0) for name, matrix in
+                   [('revenue_per_install', revenue), ('payouts_per_install', payouts)]}
+    df = pd.concat({name: frame.stack(dropna=False) for name, frame in per_install.items()}, axis=1)
+    df['net_per_install'] = df['revenue_per_install'] - df['payouts_per_install']
+    df['installs'] = base.stack(dropna=False)
+    df.index.names = ['cohort', 'age']
+    return df.droplevel('cohort') if freq is None else df
+
+
+def payback_day(curve: pd.DataFrame, cost_per_install: float):
+    """First install age at which net revenue per install covers ``cost_per_install`` (None if never)."""
+    paid = curve.index[curve['net_per_install'] >= cost_per_install]
+    return int(paid[0]) if len(paid) else None
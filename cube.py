@@ -0,0 +1,231 @@
+"""Build the daily aggregate cube the report renders from.
+
+    python cube.py
+
+One row per (event_date, country_id, app_id, network_id) with the measures of
+all four event tables: ads spend, installs, payouts and revenue, plus the
+number of raw rows behind each sum. Ads spend is keyed by its ``client_id``,
+which is the ``app_id`` of the advertised app. Payouts and revenue are
+attributed to the country, app and network of their install through
+``install_key``; events whose install is unknown get -1 for all three.
+
+The cube is written to ``<JUSTDICE_PARQUET_DIR>/cube.parquet``. Its lineage,
+the CSV versions it was built from and the row counts read from each table,
+is recorded under ``"cube"`` in ``manifest.json``, so it is rebuilt only
+when one of the ingested tables changes.
+"""
+import functools
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import ingest
+import parallel
+import stream
+
+KEYS = ["event_date", "country_id", "app_id", "network_id"]
+SEGMENTS = KEYS[1:]  # what payouts and revenue get from their install
+
+SCHEMA = pa.schema([
+    ("event_date", pa.date32()),
+    ("country_id", pa.int16()),
+    ("app_id", pa.int16()),
+    ("network_id", pa.int16()),
+    ("ads_spend", pa.float64()),
+    ("ads_rows", pa.int32()),
+    ("installs", pa.int32()),
+    ("payouts", pa.float64()),
+    ("payout_rows", pa.int32()),
+    ("revenue", pa.float64()),
+    ("revenue_rows", pa.int32()),
+])
+
+# Measures filled with 0 where a table has no rows for a cell.
+MEASURES = [field.name for field in SCHEMA if field.name not in KEYS]
+
+UNKNOWN = -1
+
+_lock = threading.RLock()
+
+
+def cube_path():
+    return os.path.join(ingest.PARQUET_DIR, "cube.parquet")
+
+
+ADS_COLUMNS = ["event_date", "country_id", "network_id", "client_id", "value_usd"]
+EVENT_COLUMNS = ["install_key", "event_date", "value_usd"]
+
+
+def attribution(installs: pd.DataFrame):
+    """Lookup arrays from install_key to the country, app and network of the install.
+
+    Each array has one extra trailing entry, UNKNOWN, for keys without an install.
+    """
+    return update_attribution({column: np.full(1, UNKNOWN, dtype=np.int16) for column in SEGMENTS}, installs)
+
+
+def update_attribution(lookup, installs: pd.DataFrame):
+    """A copy of ``lookup`` with the installs of ``installs`` added or replaced."""
+    keys = installs['install_key'].to_numpy()
+    size = max(len(lookup['country_id']), keys.max(initial=-1) + 2)
+    updated = {}
+    for column in SEGMENTS:
+        updated[column] = np.full(size, UNKNOWN, dtype=np.int16)
+        updated[column][:len(lookup[column]) - 1] = lookup[column][:-1]
+        updated[column][keys] = installs[column].to_numpy()
+    return updated
+
+
+def install_attribution():
+    """attribution() of the ingested installs, read from the same files as the rest of the cube."""
+    return attribution(stream.read("installs", ["install_key", *SEGMENTS]))
+
+
+def attribute(keys, lookup):
+    """Country, app and network of each install_key in ``keys`` (-1 where unknown)."""
+    size = len(lookup['country_id']) - 1
+    index = np.where((keys >= 0) & (keys < size), keys, -1)
+    return {column: values[index] for column, values in lookup.items()}
+
+
+def prepare_ads(ads: pd.DataFrame):
+    # Round value_usd to 2 decimal places before summing, as the report always has.
+    return ads.rename(columns={'client_id': 'app_id'}).assign(value_usd=ads['value_usd'].round(2))
+
+
+def attach_segments(events: pd.DataFrame, lookup):
+    return events.assign(**attribute(events['install_key'].to_numpy(), lookup))
+
+
+def prepare_events(lookup):
+    # A partial of a top-level function, so it can be sent to worker processes.
+    return functools.partial(attach_segments, lookup=lookup)
+
+
+def measures(agg: stream.Aggregator, value, rows: str):
+    """Cube measures of one table from its streamed aggregates."""
+    result = agg.result()
+    columns = {'count': rows} if value is None else {'sum': value, 'count': rows}
+    return result[list(columns)].rename(columns=columns)
+
+
+def rollup_ads(ads: pd.DataFrame):
+    return measures(stream.Aggregator(KEYS, 'value_usd').update(prepare_ads(ads)), 'ads_spend', 'ads_rows')
+
+
+def rollup_installs(installs: pd.DataFrame):
+    return measures(stream.Aggregator(KEYS).update(installs), None, 'installs')
+
+
+def rollup_events(events: pd.DataFrame, lookup, value: str, rows: str):
+    """Roll up payout or revenue rows, attributed to the segment of their install."""
+    agg = stream.Aggregator(KEYS, 'value_usd').update(prepare_events(lookup)(events))
+    return measures(agg, value, rows)
+
+
+def combine(rollups):
+    """Outer-join per-table rollups into cube rows, with 0 for missing measures."""
+    cube = pd.concat(rollups, axis=1).reindex(columns=MEASURES)
+    cube = cube.sort_index().reset_index()
+    cube[MEASURES] = cube[MEASURES].fillna(0)
+    return cube
+
+
+def build_cube(chunk_mb=None, workers=None):
+    """Stream the ingested tables into the cube. Returns (cube, rows read per table).
+
+    Tables are aggregated in parallel across ``workers`` processes, see parallel.py.
+    """
+    lookup = install_attribution()
+    aggs = parallel.aggregate({
+        "ads": dict(table="ads", columns=ADS_COLUMNS, keys=KEYS, value='value_usd', prepare=prepare_ads),
+        "installs": dict(table="installs", columns=KEYS, keys=KEYS),
+        "payouts": dict(table="payouts", columns=EVENT_COLUMNS, keys=KEYS, value='value_usd',
+                        prepare=prepare_events(lookup)),
+        "revenue": dict(table="revenue", columns=EVENT_COLUMNS, keys=KEYS, value='value_usd',
+                        prepare=prepare_events(lookup)),
+    }, workers=workers, chunk_mb=chunk_mb)
+    cube = combine([
+        measures(aggs["ads"], 'ads_spend', 'ads_rows'),
+        measures(aggs["installs"], None, 'installs'),
+        measures(aggs["payouts"], 'payouts', 'payout_rows'),
+        measures(aggs["revenue"], 'revenue', 'revenue_rows'),
+    ])
+    rows = {table: int(agg.count.sum()) for table, agg in aggs.items()}
+    return cube, rows
+
+
+def daily(cube: pd.DataFrame, measure: str, rows: str):
+    """Daily sums of one measure over the days that have rows for it."""
+    return cube[cube[rows] > 0].groupby('event_date')[measure].sum()
+
+
+def totals(cube: pd.DataFrame):
+    """Report totals: the sum of the daily series, with money rounded per day as in the report."""
+    return {
+        "total_ads_spend": float(daily(cube, 'ads_spend', 'ads_rows').round(2).sum()),
+        "total_installs": int(daily(cube, 'installs', 'installs').sum()),
+        "total_payouts": float(daily(cube, 'payouts', 'payout_rows').round(2).sum()),
+        "total_revenue": float(daily(cube, 'revenue', 'revenue_rows').round(2).sum()),
+    }
+
+
+def write(cube: pd.DataFrame):
+    """Write the cube atomically. Returns the number of rows written."""
+    table = pa.Table.from_pandas(cube, schema=SCHEMA, preserve_index=False)
+    tmp = cube_path() + ".tmp"
+    pq.write_table(table, tmp, compression="zstd")
+    os.replace(tmp, cube_path())
+    return table.num_rows
+
+
+def lineage(manifest=None):
+    # CSV version of every table the cube is built from, as recorded by ingest.py.
+    manifest = ingest.read_manifest() if manifest is None else manifest
+    return {table: manifest[table]["source"] for table in ingest.TABLES if table in manifest}
+
+
+def is_stale():
+    entry = ingest.read_manifest().get("cube")
+    if entry is None or "totals" not in entry or not os.path.exists(cube_path()):
+        return True
+    # A cube folded from daily partitions (see incremental.py) has no CSV inputs and is rebuilt in full.
+    return entry.get("inputs") != lineage()
+
+
+def build():
+    """Rebuild the cube from the ingested tables and record its lineage."""
+    with _lock:
+        inputs = lineage()
+        cube, rows = build_cube()
+        n = write(cube)
+        ingest.update_manifest("cube", {"inputs": inputs, "input_rows": rows, "rows": n, "totals": totals(cube)})
+        return n
+
+
+def refresh():
+    """Rebuild the cube if any of its inputs changed since it was built."""
+    if is_stale():
+        with _lock:
+            # Another thread may have rebuilt it while we waited.
+            if is_stale():
+                build()
+
+
+if __name__ == "__main__":
+    import incremental  # incremental imports this module
+
+    ingest.ingest()
+    if incremental.enabled():
+        # The cube is folded from the daily partitions, the same files stream.py reads.
+        incremental.refresh()
+        rows = ingest.read_manifest()["cube"]["rows"]
+    else:
+        rows = build()
+    entry = ingest.read_manifest()["cube"]
+    read = ", ".join(f"{table} {n:,}" for table, n in entry["input_rows"].items())
+    print(f"cube: {rows:,} rows from {read} -> {cube_path()}")
@@ -0,0 +1,324 @@
+"""Shared, cached data-loading layer for the report.
+
+Every frame and aggregate the report needs goes through this module. The
+raw CSV exports are converted to typed Parquet files by ingest.py (only the
+ones that are new or changed), and the report's aggregates are rolled up
+from the daily cube built from them by cube.py rather than from raw event
+rows. The cube and everything derived from it are memoized in a
+process-wide cache keyed on the cube file's path, size and mtime, so all
+Streamlit sessions served by the same process share one copy. Inputs are
+checked for changes at most once every ``JUSTDICE_REFRESH_SECONDS``
+(default 2), so a changed export is picked up by a lookup within that time.
+The cache is capped by ``JUSTDICE_CACHE_MB`` and evicts least recently used
+entries; a value larger than the whole cap is returned uncached.
+
+Frames returned from here are shared between sessions: callers must treat
+them as read-only and ``.copy()`` before adding columns.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+import anomalies
+import cohorts
+import cube
+import incremental
+import ingest
+import slicer
+import uniques
+
+CACHE_LIMIT_MB = float(os.environ.get("JUSTDICE_CACHE_MB", "1024"))
+REFRESH_SECONDS = float(os.environ.get("JUSTDICE_REFRESH_SECONDS", "2"))
+
+log = logging.getLogger(__name__)
+
+_checked = float("-inf")  # time.monotonic() of the last freshness check
+_check_lock = threading.Lock()
+
+
+def file_version(path: str):
+    # (path, size, mtime) identifies one version of a file on disk.
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+def frame_nbytes(value):
+    # Rough in-memory size of a cached value, used for the memory cap.
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, (tuple, list)):
+        return sum(frame_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(frame_nbytes(v) for v in value.values())
+    if isinstance(value, (str, bytes)):
+        return len(value)  # e.g. a chart's JSON spec, see charts.py
+    return int(getattr(value, "nbytes", 64))
+
+
+class FrameCache:
+    """Thread-safe LRU cache bounded by the total size of its values."""
+
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._size = 0
+        self._lock = threading.Lock()
+        self._building = {}  # key -> lock, so one thread builds while others wait
+        self.hits = 0
+        self.misses = 0
+        self.oversized = 0  # values not cached because they alone exceed the limit
+
+    def get_or_build(self, key, build):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            key_lock = self._building.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Another thread may have finished building while we waited.
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][0]
+                self.misses += 1
+            value = build()
+            self._put(key, value)
+        with self._lock:
+            self._building.pop(key, None)
+        return value
+
+    def _put(self, key, value):
+        nbytes = frame_nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            if nbytes > self.limit_bytes:
+                # Caching it would flush everything else and still exceed the cap: hand it back uncached.
+                self.oversized += 1
+                log.warning("not caching %s: %.0f MB is over the %.0f MB cache limit (JUSTDICE_CACHE_MB)",
+                            key, nbytes / 2**20, self.limit_bytes / 2**20)
+                return
+            self._entries[key] = (value, nbytes)
+            self._size += nbytes
+            # Evict least recently used entries until the new one fits.
+            while self._size > self.limit_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "limit_bytes": self.limit_bytes,
+                    "hits": self.hits, "misses": self.misses, "oversized": self.oversized}
+
+
+cache = FrameCache(int(CACHE_LIMIT_MB * 1024 * 1024))
+
+
+def refresh():
+    """Convert changed CSVs and bring the cube up to date, at most once every ``REFRESH_SECONDS``."""
+    global _checked
+    with _check_lock:
+        if time.monotonic() - _checked < REFRESH_SECONDS:
+            return
+        ingest.ingest()
+        if incremental.enabled():
+            # Daily event files are folded into the cube one new or changed day at a time.
+            incremental.refresh()
+        else:
+            cube.refresh()
+        _checked = time.monotonic()
+
+
+def cached(name: str, build):
+    """Return ``build()`` memoized under ``name`` and the current version of the cube."""
+    # Between freshness checks a lookup costs one stat.
+    refresh()
+    key = (name, file_version(cube.cube_path()))
+    return cache.get_or_build(key, build)
+
+
+# The cube
+
+def read_cube(columns=None):
+    """Read ``columns`` (default: all) of the cube into a DataFrame."""
+    table = pq.read_table(cube.cube_path(), columns=columns, memory_map=True)
+    df = table.to_pandas(date_as_object=False, split_blocks=True, self_destruct=True)
+    if 'event_date' in df:
+        # date32 arrives as datetime64[ms]; keep the nanosecond dtype the rest of the code expects.
+        df['event_date'] = df['event_date'].astype('datetime64[ns]')
+    return df
+
+
+# Derived aggregates, all rolled up from the precomputed cube (see cube.py). Each takes
+# optional slicer.Filters; filtered rollups are slices of the indexed cube, not regroupings.
+
+def load_cube():
+    return cached("cube", read_cube)
+
+
+def cube_index():
+    return cached("cube_index", lambda: slicer.CubeIndex(load_cube()))
+
+
+def _key(name: str, filters):
+    return f"{name}{tuple(slicer.normalize(filters))}" if slicer.is_active(filters) else name
+
+
+def cached_view(name: str, filters, build):
+    """``build()`` memoized per cube version and ``filters``, for objects derived from the aggregates below."""
+    return cached(_key(name, filters), build)
+
+
+def _daily(measure: str, rows: str, column: str, filters):
+    df = cube_index().daily(measure, rows, filters).reset_index()
+    df.columns = ['event_date', column]
+    return df
+
+
+def _total_installs(by: str, filters):
+    df = cube_index().totals_by([by], ['installs'], filters)
+    df = df[df['installs'] > 0].astype({'installs': 'int64'}).reset_index(drop=True)
+    df.columns = [by, 'total_installs']
+    return df
+
+
+def ads_by_date(filters=None):
+    def build():
+        df = _daily('ads_spend', 'ads_rows', 'daily_ads_spend', filters)
+        df['daily_ads_spend'] = df['daily_ads_spend'].round(2)
+        return df
+    return cached(_key("ads_by_date", filters), build)
+
+
+def installs_by_date(filters=None):
+    def build():
+        df = _daily('installs', 'installs', 'daily_installs', filters)
+        df['daily_installs'] = df['daily_installs'].astype('int64')
+        return df
+    return cached(_key("installs_by_date", filters), build)
+
+
+def installs_by_country(filters=None):
+    return cached(_key("installs_by_country", filters), lambda: _total_installs('country_id', filters))
+
+
+def installs_by_app(filters=None):
+    def build():
+        return _total_installs('app_id', filters).sort_values('total_installs', ascending=False)
+    return cached(_key("installs_by_app", filters), build)
+
+
+def payouts_by_date(filters=None):
+    def build():
+        df = _daily('payouts', 'payout_rows', 'daily_payouts', filters)
+        df['daily_payouts'] = df['daily_payouts'].round(2)
+        return df
+    return cached(_key("payouts_by_date", filters), build)
+
+
+def revenue_by_date(filters=None):
+    def build():
+        df = _daily('revenue', 'revenue_rows', 'daily_revenue', filters)
+        df['daily_revenue'] = df['daily_revenue'].round(2)
+        return df
+    return cached(_key("revenue_by_date", filters), build)
+
+
+def totals(filters=None):
+    """Totals (total_ads_spend, total_installs, total_payouts, total_revenue) of the filtered daily series.
+
+    Unfiltered, these are the running totals kept with the cube.
+    """
+    if not slicer.is_active(filters):
+        return cached("totals", lambda: ingest.read_manifest()["cube"]["totals"])
+
+    def build():
+        return {
+            "total_ads_spend": float(ads_by_date(filters)['daily_ads_spend'].sum()),
+            "total_installs": int(installs_by_date(filters)['daily_installs'].sum()),
+            "total_payouts": float(payouts_by_date(filters)['daily_payouts'].sum()),
+            "total_revenue": float(revenue_by_date(filters)['daily_revenue'].sum()),
+        }
+    return cached(_key("totals", filters), build)
+
+
+SEGMENTS = slicer.SEGMENTS
+
+
+def segment_values():
+    """Every known country_id, app_id and network_id in the cube, for filter widgets."""
+    def build():
+        return {dim: [v for v in cube_index().values[dim].tolist() if v != cube.UNKNOWN] for dim in SEGMENTS}
+    return cached("segment_values", build)
+
+
+def date_bounds():
+    """First and last event_date in the cube, as datetime.date."""
+    def build():
+        dates = cube_index().dates()
+        return dates[0].date(), dates[-1].date()
+    return cached("date_bounds", build)
+
+
+def unit_economics(by=tuple(SEGMENTS), filters=None):
+    """Installs, spend, payouts, revenue and per-install economics for each segment of ``by``.
+
+    Revenue and payouts are attributed to the segment of their install (see
+    cube.py) and ads spend is matched on the same keys, with ``client_id``
+    standing for the app. ``ltv`` and ``payout_per_install`` are per install
+    of the segment and ``roas`` is revenue per dollar of ads spend; they are
+    NaN where the segment has no installs or no spend.
+    """
+    by = [column for column in SEGMENTS if column in by]
+
+    def build():
+        df = cube_index().totals_by(by, ['installs', 'ads_spend', 'payouts', 'revenue'], filters)
+        df['installs'] = df['installs'].astype('int64')
+        df['profit'] = df['revenue'] - df['payouts'] - df['ads_spend']
+        installs = df['installs'].where(df['installs'] > 0)
+        df['ltv'] = df['revenue'] / installs
+        df['payout_per_install'] = df['payouts'] / installs
+        df['profit_per_install'] = df['profit'] / installs
+        df['roas'] = df['revenue'] / df['ads_spend'].where(df['ads_spend'] > 0)
+        return df.sort_values('revenue', ascending=False, ignore_index=True)
+    return cached(_key(f"unit_economics[{','.join(by)}]", filters), build)
+
+
+def segment_anomalies(name: str):
+    """Anomalies and changes of the daily ``name`` series of every country × app, see anomalies.py.
+
+    A new version of the cube only scans the days that changed in it.
+    """
+    return cached(f"segment_anomalies[{name}]", lambda: anomalies.scan_segments(cube_index(), name))
+
+
+def install_cohorts():
+    """Installs, revenue and payouts per segment, cohort and age, see cohorts.py."""
+    return cached("install_cohorts", cohorts.build)
+
+
+def cohort_curves(countries=(), apps=(), freq=None, start=None, end=None):
+    """Per-install cohort curves of the given countries and apps (all when empty), for cohorts installed in [start, end]."""
+    countries, apps = sorted(countries), sorted(apps)
+    key = f"cohort_curves[{countries},{apps},{freq},{start},{end}]"
+    return cached(key, lambda: cohorts.curves(install_cohorts(), countries, apps, freq, start, end))
+
+
+def distinct_installs():
+    """Distinct install keys and sketches per date, country and app of installs, payouts and revenue, see uniques.py."""
+    return cached("distinct_installs", uniques.build)
+
+
+def unique_installs(filters=None, freq=None):
+    """Unique installs, payers and earners with standard errors, and the payer conversion, per period of ``freq``."""
+    return cached(_key(f"unique_installs[{freq}]", filters), lambda: uniques.conversion(distinct_installs(), filters, freq))
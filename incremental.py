@@ -0,0 +1,292 @@
+"""Incremental, append-only refresh of the cube from daily event files.
+
+    python incremental.py [--split]
+
+Daily exports are read from ``<JUSTDICE_DAILY_DIR>/<table>/<YYYY-MM-DD>.csv``
+(default ``daily/`` in the data directory); ``--split`` cuts the full CSV
+exports into that layout once. Each day file is converted to a typed
+partition ``<JUSTDICE_PARQUET_DIR>/daily/<table>/<YYYY-MM-DD>.parquet`` and
+folded into the cube. ``partitions.json`` next to the partitions records
+the size, mtime, SHA-256 and row count of every folded day file, so a
+refresh only reads the days that are new, removed or whose checksum changed,
+regroups the cube rows of those days alone and recomputes the running
+totals from the cube. It is kept out of ``manifest.json``, which is read on
+every freshness check.
+
+Events are attributed to the installs folded in so far, through the lookup
+of cube.attribution(), which is kept in ``attribution.parquet`` next to the
+partitions and updated with each new day of installs. When a day of
+installs that was already folded changes, the lookup is rebuilt and every
+payout and revenue day is folded again, since any of them may reference the
+changed installs. The cube, the lookup and the install key dictionary are
+also kept in memory between refreshes of the same process, as long as
+their files are unchanged.
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import cube
+import ingest
+from keys import KeyDictionary, segment_paths
+
+DAILY_DIR = os.environ.get("JUSTDICE_DAILY_DIR", os.path.join(ingest.DATA_DIR, "daily"))
+PARTITION_DIR = os.path.join(ingest.PARQUET_DIR, "daily")
+
+# Cube measures each table contributes.
+MEASURES = {
+    "ads": ["ads_spend", "ads_rows"],
+    "installs": ["installs"],
+    "payouts": ["payouts", "payout_rows"],
+    "revenue": ["revenue", "revenue_rows"],
+}
+
+# A cube row with none of these left no longer has any data behind it.
+ROW_COUNTS = ["ads_rows", "installs", "payout_rows", "revenue_rows"]
+
+_lock = threading.Lock()
+_loaded = {}  # name -> (version of its files, value), as this process last read or wrote them
+
+
+def enabled():
+    return os.path.isdir(DAILY_DIR)
+
+
+def day_path(table: str, date: str):
+    return os.path.join(DAILY_DIR, table, f"{date}.csv")
+
+
+def partition_path(table: str, date: str):
+    return os.path.join(PARTITION_DIR, table, f"{date}.parquet")
+
+
+def state_path():
+    return os.path.join(PARTITION_DIR, "partitions.json")
+
+
+def attribution_path():
+    return os.path.join(PARTITION_DIR, "attribution.parquet")
+
+
+def read_state():
+    """{table: {date: entry}} of the folded day files."""
+    try:
+        with open(state_path()) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_state(state):
+    # Unindented: with one entry per day file, the indented encoder is the slow part of a refresh.
+    ingest.write_json(state_path(), state, indent=None)
+
+
+def read_attribution():
+    if not os.path.exists(attribution_path()):
+        return None
+    table = pq.read_table(attribution_path())
+    return {column: table.column(column).to_numpy() for column in cube.SEGMENTS}
+
+
+def write_attribution(lookup):
+    tmp = attribution_path() + ".tmp"
+    pq.write_table(pa.table(lookup), tmp)
+    os.replace(tmp, attribution_path())
+
+
+def _version(paths):
+    return [ingest.source_version(path) for path in paths if os.path.exists(path)]
+
+
+def _reuse(name: str, paths, read):
+    """The value last read or written under ``name`` if ``paths`` have not changed since, else ``read()``."""
+    version = _version(paths)
+    if name in _loaded and _loaded[name][0] == version:
+        return _loaded[name][1]
+    value = read()
+    _loaded[name] = (version, value)
+    return value
+
+
+def _remember(name: str, paths, value):
+    _loaded[name] = (_version(paths), value)
+
+
+def _dictionary_paths():
+    return [ingest.dictionary_path(), *segment_paths(ingest.dictionary_path())]
+
+
+def checksum(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def split_csv(table: str):
+    """Cut a full CSV export into one file per event_date. Returns the number of days written."""
+    df = pd.read_csv(ingest.csv_path(table), dtype=str)
+    os.makedirs(os.path.join(DAILY_DIR, table), exist_ok=True)
+    for date, day in df.groupby('event_date'):
+        day.to_csv(day_path(table, date), index=False)
+    return df['event_date'].nunique()
+
+
+def day_files(table: str):
+    directory = os.path.join(DAILY_DIR, table)
+    if not os.path.isdir(directory):
+        return {}
+    return {name[:-4]: os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".csv")}
+
+
+def changed_days(table: str, folded):
+    """Days of ``table`` to fold again and the number of day files only touched.
+
+    The days are {date: (version, sha256)} for new or changed files and
+    {date: None} for removed ones. Files that were only touched keep their
+    partition; their new version is recorded in ``folded`` so they are not
+    hashed again.
+    """
+    files = day_files(table)
+    changed = {date: None for date in folded if date not in files}
+    touched = 0
+    for date, path in files.items():
+        version = ingest.source_version(path)
+        entry = folded.get(date)
+        if entry is not None and entry["file"] == version:
+            continue
+        digest = checksum(path)
+        if entry is not None and entry["sha256"] == digest:
+            entry["file"] = version
+            touched += 1
+            continue
+        changed[date] = (version, digest)
+    return changed, touched
+
+
+def fold(table: str, changed, folded, dictionary: KeyDictionary):
+    """Convert the changed day files of ``table`` into partitions and return their rows."""
+    os.makedirs(os.path.join(PARTITION_DIR, table), exist_ok=True)
+    frames = []
+    for date, change in sorted(changed.items()):
+        if change is None:
+            folded.pop(date)
+            if os.path.exists(partition_path(table, date)):
+                os.remove(partition_path(table, date))
+            continue
+        converted = ingest.to_schema(ingest.read_csv_typed(day_path(table, date)), table, dictionary)
+        pq.write_table(converted, partition_path(table, date), compression="zstd")
+        folded[date] = {"file": change[0], "sha256": change[1], "rows": converted.num_rows}
+        frames.append(converted.to_pandas(date_as_object=False))
+    if not frames:
+        return ingest.SCHEMAS[table].empty_table().to_pandas(date_as_object=False)
+    return pd.concat(frames, ignore_index=True)
+
+
+def partition_paths(table: str):
+    directory = os.path.join(PARTITION_DIR, table)
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)) if os.path.isdir(directory) else []
+
+
+def load_cube(manifest):
+    # Start from scratch unless the current cube was itself built from partitions.
+    if manifest.get("cube", {}).get("mode") == "incremental" and os.path.exists(cube.cube_path()):
+        return pq.read_table(cube.cube_path()).to_pandas(date_as_object=False)
+    return cube.SCHEMA.empty_table().to_pandas(date_as_object=False)
+
+
+def update_cube(current: pd.DataFrame, changed, rollups):
+    """Replace the measures of the changed days of each table with their new rollups.
+
+    Only the rows of the changed days are regrouped; ``current`` and the
+    result are sorted by ``cube.KEYS``.
+    """
+    hit = current['event_date'].isin(pd.to_datetime(sorted(set().union(*changed.values()))))
+    days = current[hit].copy()
+    for table, dates in changed.items():
+        days.loc[days['event_date'].isin(pd.to_datetime(list(dates))), MEASURES[table]] = 0
+    rows = [days.set_index(cube.KEYS)[cube.MEASURES]] + [r.reindex(columns=cube.MEASURES, fill_value=0) for r in rollups]
+    days = pd.concat(rows).groupby(level=cube.KEYS).sum()
+    days = days[(days[ROW_COUNTS] > 0).any(axis=1)].reset_index()
+    # The other days keep their rows; a stable sort by date puts the regrouped days back in place.
+    updated = pd.concat([current[~hit], days], ignore_index=True)
+    return updated.sort_values('event_date', kind='stable', ignore_index=True)
+
+
+def refresh():
+    """Fold new, changed and removed day files into the cube. Returns {table: [dates folded]}."""
+    with _lock:
+        try:
+            return _refresh()
+        except BaseException:
+            # The dictionary, lookup or cube in memory may be ahead of their files now.
+            _loaded.clear()
+            raise
+
+
+def _refresh():
+    manifest = ingest.read_manifest()
+    had_cube = manifest.get("cube", {}).get("mode") == "incremental"
+    # Unless the current cube was built from partitions, every day file is new.
+    state = read_state() if had_cube else {}
+    old_installs = set(state.get("installs", {}))
+    scanned = {table: changed_days(table, state.setdefault(table, {})) for table in ingest.TABLES}
+    changed = {table: days for table, (days, _) in scanned.items()}
+    touched = sum(n for _, n in scanned.values())
+    reattribute = bool(old_installs & set(changed["installs"]))
+    if reattribute:
+        for table in ("payouts", "revenue"):
+            for date, path in day_files(table).items():
+                changed[table].setdefault(date, (ingest.source_version(path), checksum(path)))
+    if not any(changed.values()):
+        if touched:
+            write_state(state)
+        return {}
+
+    os.makedirs(PARTITION_DIR, exist_ok=True)
+    dictionary = _reuse("dictionary", _dictionary_paths(), lambda: KeyDictionary.load(ingest.dictionary_path()))
+    # ingest.TABLES folds installs before the events that reference them.
+    rows = {table: fold(table, changed[table], state[table], dictionary) for table in ingest.TABLES}
+    dictionary.save(ingest.dictionary_path())
+    _remember("dictionary", _dictionary_paths(), dictionary)
+
+    lookup = None if reattribute or not had_cube else _reuse("attribution", [attribution_path()], read_attribution)
+    if lookup is None:
+        lookup = cube.install_attribution()
+    elif changed["installs"]:
+        lookup = cube.update_attribution(lookup, rows["installs"])
+    if changed["installs"] or not os.path.exists(attribution_path()):
+        write_attribution(lookup)
+        _remember("attribution", [attribution_path()], lookup)
+
+    current = _reuse("cube", [cube.cube_path()], lambda: load_cube(manifest)) if had_cube else load_cube(manifest)
+    updated = update_cube(current, changed, [
+        cube.rollup_ads(rows["ads"]),
+        cube.rollup_installs(rows["installs"]),
+        cube.rollup_events(rows["payouts"], lookup, 'payouts', 'payout_rows'),
+        cube.rollup_events(rows["revenue"], lookup, 'revenue', 'revenue_rows'),
+    ])
+    n = cube.write(updated)
+    _remember("cube", [cube.cube_path()], updated)
+    input_rows = {table: sum(entry["rows"] for entry in state[table].values()) for table in ingest.TABLES}
+    write_state(state)
+    ingest.update_manifest("install_ids", {"rows": len(dictionary)})
+    ingest.update_manifest("cube", {"mode": "incremental", "input_rows": input_rows, "rows": n,
+                                    "totals": cube.totals(updated)})
+    return {table: sorted(days) for table, days in changed.items() if days}
+
+
+if __name__ == "__main__":
+    if "--split" in sys.argv[1:]:
+        for table in ingest.TABLES:
+            print(f"{table}: {split_csv(table)} days -> {os.path.join(DAILY_DIR, table)}")
+    for table, dates in refresh().items():
+        print(f"{table}: folded {len(dates)} days ({dates[0]} .. {dates[-1]})")
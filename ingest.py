@@ -0,0 +1,211 @@
+"""Convert the raw CSV exports into typed, columnar Parquet files.
+
+    python ingest.py [table ...]
+
+Each CSV is parsed once, in blocks of ``JUSTDICE_CHUNK_MB``, into
+``<JUSTDICE_PARQUET_DIR>/<table>.parquet`` with a fixed schema: date32
+``event_date``, int16 ids, a categorical ``device_os_version`` and an int32
+``install_key`` in place of the hex ``install_id`` (the ids themselves live
+once in ``install_ids.parquet``, see keys.py). ``manifest.json`` records
+the size and mtime of the CSV each file was built from, so ``data.py`` can
+re-ingest a table only when its CSV changes.
+"""
+import json
+import os
+import sys
+import threading
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from keys import KeyDictionary
+
+DATA_DIR = os.environ.get("JUSTDICE_DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+PARQUET_DIR = os.environ.get("JUSTDICE_PARQUET_DIR", os.path.join(DATA_DIR, "parquet"))
+
+CSV_FILES = {
+    "ads": "adspend.csv",
+    "installs": "installs.csv",
+    "payouts": "payouts.csv",
+    "revenue": "revenue.csv",
+}
+
+# Installs first, so install keys follow install order.
+TABLES = ["ads", "installs", "payouts", "revenue"]
+
+SCHEMAS = {
+    "ads": pa.schema([
+        ("event_date", pa.date32()),
+        ("country_id", pa.int16()),
+        ("network_id", pa.int16()),
+        ("client_id", pa.int16()),
+        ("value_usd", pa.float64()),
+    ]),
+    "installs": pa.schema([
+        ("install_key", pa.int32()),
+        ("country_id", pa.int16()),
+        ("app_id", pa.int16()),
+        ("network_id", pa.int16()),
+        ("event_date", pa.date32()),
+        ("device_os_version", pa.dictionary(pa.int32(), pa.string())),
+    ]),
+    "payouts": pa.schema([
+        ("install_key", pa.int32()),
+        ("event_date", pa.date32()),
+        ("value_usd", pa.float64()),
+    ]),
+    "revenue": pa.schema([
+        ("install_key", pa.int32()),
+        ("event_date", pa.date32()),
+        ("value_usd", pa.float64()),
+    ]),
+}
+
+# Types used while parsing the CSV; install_id is replaced by install_key afterwards.
+CSV_TYPES = {
+    "event_date": pa.date32(),
+    "country_id": pa.int16(),
+    "network_id": pa.int16(),
+    "client_id": pa.int16(),
+    "app_id": pa.int16(),
+    "value_usd": pa.float64(),
+    "install_id": pa.string(),
+    "device_os_version": pa.dictionary(pa.int32(), pa.string()),
+}
+
+# Rows per Parquet row group; also the unit of memory-mapped column reads.
+ROW_GROUP_SIZE = 256 * 1024
+
+# Size of the blocks CSVs are converted in, and of the chunks stream.py aggregates.
+CHUNK_MB = float(os.environ.get("JUSTDICE_CHUNK_MB", "64"))
+
+_lock = threading.Lock()
+
+
+def csv_path(table: str):
+    return os.path.join(DATA_DIR, CSV_FILES[table])
+
+
+def parquet_path(table: str):
+    return os.path.join(PARQUET_DIR, f"{table}.parquet")
+
+
+def dictionary_path():
+    return os.path.join(PARQUET_DIR, "install_ids.parquet")
+
+
+def manifest_path():
+    return os.path.join(PARQUET_DIR, "manifest.json")
+
+
+def read_manifest():
+    try:
+        with open(manifest_path()) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_json(path: str, obj, indent=2):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f, indent=indent, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def update_manifest(name: str, entry):
+    """Record ``entry`` under ``name`` in the manifest, keeping every other entry."""
+    with _lock:
+        manifest = read_manifest()
+        manifest[name] = entry
+        write_json(manifest_path(), manifest)
+
+
+def source_version(path: str):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _csv_options(path: str):
+    with open(path, "rb") as f:
+        names = f.readline().decode().strip().split(",")
+    types = {name: CSV_TYPES[name] for name in names if name in CSV_TYPES}
+    return pacsv.ConvertOptions(column_types=types)
+
+
+def read_csv_typed(path: str):
+    """Parse one CSV export with the typed column layout (install_id still as text)."""
+    return pacsv.read_csv(path, convert_options=_csv_options(path))
+
+
+def open_csv_typed(path: str, block_mb=None):
+    """Like ``read_csv_typed``, but yield the file as record batches of about ``block_mb``."""
+    block_mb = CHUNK_MB if block_mb is None else block_mb
+    read_options = pacsv.ReadOptions(block_size=int(block_mb * 1024 * 1024))
+    return pacsv.open_csv(path, read_options=read_options, convert_options=_csv_options(path))
+
+
+def to_schema(raw: pa.Table, table: str, dictionary: KeyDictionary):
+    """Replace install_id with install_key and order/cast columns to the fixed schema."""
+    schema = SCHEMAS[table]
+    columns = []
+    for field in schema:
+        if field.name == "install_key":
+            columns.append(dictionary.encode(raw.column("install_id")))
+        else:
+            columns.append(raw.column(field.name).cast(field.type))
+    return pa.table(columns, schema=schema)
+
+
+def ingest_table(table: str, dictionary: KeyDictionary):
+    """Convert one CSV into its Parquet file, block by block, and return its manifest entry."""
+    source = csv_path(table)
+    version = source_version(source)
+    tmp = parquet_path(table) + ".tmp"
+    rows = 0
+    with pq.ParquetWriter(tmp, SCHEMAS[table], compression="zstd") as writer:
+        for batch in open_csv_typed(source):
+            converted = to_schema(pa.Table.from_batches([batch]), table, dictionary)
+            writer.write_table(converted, row_group_size=ROW_GROUP_SIZE)
+            rows += converted.num_rows
+    os.replace(tmp, parquet_path(table))
+    return {"source": version, "rows": rows}
+
+
+def stale_tables(tables=TABLES):
+    """Tables whose CSV exists and differs from the one their Parquet file was built from."""
+    manifest = read_manifest()
+    stale = []
+    for table in tables:
+        if not os.path.exists(csv_path(table)):
+            continue
+        entry = manifest.get(table)
+        if entry is None or not os.path.exists(parquet_path(table)) or entry["source"] != source_version(csv_path(table)):
+            stale.append(table)
+    return stale
+
+
+def ingest(tables=None):
+    """Convert the given (default: stale) tables. Returns the list of converted tables."""
+    with _lock:
+        tables = stale_tables() if tables is None else [t for t in TABLES if t in tables]
+        if not tables:
+            return []
+        os.makedirs(PARQUET_DIR, exist_ok=True)
+        dictionary = KeyDictionary.load(dictionary_path())
+        manifest = read_manifest()
+        for table in tables:
+            manifest[table] = ingest_table(table, dictionary)
+        dictionary.save(dictionary_path())
+        manifest["install_ids"] = {"rows": len(dictionary)}
+        write_json(manifest_path(), manifest)
+        return tables
+
+
+if __name__ == "__main__":
+    done = ingest(sys.argv[1:] or TABLES)
+    for table, entry in read_manifest().items():
+        if table in done:
+            print(f"{table}: {entry['rows']:,} rows -> {parquet_path(table)}")
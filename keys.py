@@ -0,0 +1,223 @@
+"""Compact encodings for the 64-char hex ``install_id``.
+
+Install ids are SHA-256 style hex digests. On disk they are kept once, as
+32-byte binary values, in a dictionary that maps each id to a dense int32
+``install_key``; every event table stores only the key. In memory the
+dictionary also keeps the first 8 bytes of its ids sorted, so a batch is
+encoded by a binary search of its distinct ids, at a cost that does not
+grow with the number of ids already known. An id that is not 64 hex digits
+is an error rather than a key.
+
+Ids added after the dictionary file was written are saved as segment files
+in a directory of the same name (``install_ids/<first key>.parquet``), so a
+small batch of new ids does not rewrite the whole dictionary; after
+``MAX_SEGMENTS`` of them it is compacted into one file again.
+"""
+import os
+import shutil
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+ID_BYTES = 32
+MAX_SEGMENTS = 64
+
+# Value of each ASCII hex digit, 0 for anything else.
+_HEX_VALUES = np.zeros(256, dtype=np.uint8)
+_HEX_VALUES[np.frombuffer(b"0123456789", dtype=np.uint8)] = np.arange(10)
+_HEX_VALUES[np.frombuffer(b"abcdef", dtype=np.uint8)] = np.arange(10, 16)
+_HEX_VALUES[np.frombuffer(b"ABCDEF", dtype=np.uint8)] = np.arange(10, 16)
+_IS_HEX = np.zeros(256, dtype=bool)
+_IS_HEX[np.frombuffer(b"0123456789abcdefABCDEF", dtype=np.uint8)] = True
+
+
+def _hex_matrix(ids, width: int):
+    # (n, width) uint8 matrix of the first `width` ASCII characters of each id.
+    if isinstance(ids, pa.ChunkedArray):
+        ids = ids.combine_chunks()
+    if isinstance(ids, pa.Array) and len(ids):
+        ids = ids.cast(pa.string())
+        if ids.null_count == 0 and pc.all(pc.equal(pc.binary_length(ids), width)).as_py():
+            # Strings of equal length lie back to back in the data buffer: view it without copying.
+            start = np.frombuffer(ids.buffers()[1], dtype=np.int32)[ids.offset]
+            data = np.frombuffer(ids.buffers()[2], dtype=np.uint8)
+            return data[start:start + len(ids) * width].reshape(-1, width)
+        ids = ids.to_numpy(zero_copy_only=False)
+    elif isinstance(ids, pa.Array):
+        ids = ids.to_numpy(zero_copy_only=False)
+    return np.asarray(ids, dtype=f"S{width}").view(np.uint8).reshape(-1, width)
+
+
+def _lengths(ids):
+    # Length of each id, -1 for nulls.
+    if isinstance(ids, (pa.Array, pa.ChunkedArray)):
+        return pc.fill_null(pc.binary_length(ids.cast(pa.string())), -1).to_numpy(zero_copy_only=False)
+    return np.char.str_len(np.asarray(ids))
+
+
+def hex_to_bytes(ids):
+    """Vectorized ``bytes.fromhex`` for an array of 64-char hex ids -> (n, 32) uint8.
+
+    Raises ValueError, with the number of bad ids and an example, if any id
+    is not exactly 64 hex digits.
+    """
+    chars = _hex_matrix(ids, 2 * ID_BYTES)
+    bad = (_lengths(ids) != 2 * ID_BYTES) | ~_IS_HEX[chars].all(axis=1)
+    if bad.any():
+        example = ids[int(np.argmax(bad))]
+        example = example.as_py() if isinstance(example, pa.Scalar) else example
+        raise ValueError(f"{int(bad.sum())} install_id values are not {2 * ID_BYTES} hex digits, e.g. {example!r}")
+    nibbles = _HEX_VALUES[chars]
+    return (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+
+
+def bytes_to_hex(raw):
+    """Inverse of ``hex_to_bytes``: (n, 32) uint8 -> array of hex strings."""
+    digits = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+    raw = np.asarray(raw, dtype=np.uint8).reshape(-1, ID_BYTES)
+    out = np.empty((raw.shape[0], 2 * ID_BYTES), dtype=np.uint8)
+    out[:, 0::2] = digits[raw >> 4]
+    out[:, 1::2] = digits[raw & 0x0F]
+    return out.view(f"S{2 * ID_BYTES}").ravel().astype(str)
+
+
+def prefixes(raw):
+    """The first 8 bytes of each (n, 32) uint8 id as an unsigned integer, ordered like the bytes."""
+    return np.ascontiguousarray(raw[:, :8]).view(">u8").ravel().astype(np.uint64)
+
+
+def fixed_binary_array(raw):
+    # (n, 32) uint8 matrix -> pyarrow fixed_size_binary(32) array without copying per value.
+    raw = np.ascontiguousarray(raw, dtype=np.uint8)
+    return pa.FixedSizeBinaryArray.from_buffers(pa.binary(ID_BYTES), raw.shape[0], [None, pa.py_buffer(raw)])
+
+
+def binary_matrix(arr):
+    # pyarrow fixed_size_binary(32) array -> (n, 32) uint8 matrix.
+    if isinstance(arr, pa.ChunkedArray):
+        arr = arr.combine_chunks()
+    data = np.frombuffer(arr.buffers()[1], dtype=np.uint8)
+    start = arr.offset * ID_BYTES
+    return data[start:start + len(arr) * ID_BYTES].reshape(-1, ID_BYTES)
+
+
+def segment_paths(path: str):
+    """Segment files of the dictionary at ``path``, in key order."""
+    directory = os.path.splitext(path)[0]
+    names = sorted(name for name in os.listdir(directory) if name.endswith(".parquet")) if os.path.isdir(directory) else []
+    return [os.path.join(directory, name) for name in names]
+
+
+def _write(table: pa.Table, path: str):
+    tmp = path + ".tmp"
+    pq.write_table(table, tmp)
+    os.replace(tmp, path)
+
+
+class KeyDictionary:
+    """Append-only mapping from install_id to a dense int32 install_key.
+
+    Keys are assigned in order of first appearance and never change, so
+    tables encoded earlier stay valid when new ids are added.
+    """
+
+    schema = pa.schema([("install_key", pa.int32()), ("install_id", pa.binary(ID_BYTES))])
+
+    def __init__(self, raw=None):
+        # (n, 32) uint8 matrix of every known id; row == install_key.
+        self.raw = np.zeros((0, ID_BYTES), dtype=np.uint8) if raw is None else raw
+        self._buffer = self.raw  # room for appended ids past len(self.raw)
+        # prefixes() of the ids, sorted, and the install_key of each.
+        prefix = prefixes(self.raw)
+        self.order = np.argsort(prefix, kind="stable").astype(np.int32)
+        self.prefixes = prefix[self.order]
+        self.saved = 0  # ids already in the files this dictionary was loaded from
+
+    def __len__(self):
+        return len(self.raw)
+
+    @classmethod
+    def load(cls, path: str):
+        if not os.path.exists(path):
+            return cls()
+        parts = [binary_matrix(pq.read_table(path, columns=["install_id"]).column("install_id"))]
+        n = len(parts[0])
+        for segment in segment_paths(path):
+            first = int(os.path.basename(segment).split(".")[0])
+            if first > n:
+                break
+            if first == n:  # earlier ones are left over from before the last compaction
+                parts.append(binary_matrix(pq.read_table(segment, columns=["install_id"]).column("install_id")))
+                n += len(parts[-1])
+        dictionary = cls(np.concatenate(parts))
+        dictionary.saved = len(dictionary)
+        return dictionary
+
+    def save(self, path: str):
+        """Write the ids added since ``load(path)`` as a new segment, or the whole dictionary."""
+        if self.saved and os.path.exists(path) and len(segment_paths(path)) < MAX_SEGMENTS:
+            if len(self) > self.saved:
+                os.makedirs(os.path.splitext(path)[0], exist_ok=True)
+                _write(self._table(self.saved), os.path.join(os.path.splitext(path)[0], f"{self.saved:010d}.parquet"))
+        else:
+            _write(self._table(0), path)
+            shutil.rmtree(os.path.splitext(path)[0], ignore_errors=True)
+        self.saved = len(self)
+
+    def _table(self, start: int):
+        # The ids from key ``start`` on, with their keys.
+        return pa.table([pa.array(np.arange(start, len(self), dtype=np.int32)), fixed_binary_array(self.raw[start:])],
+                        schema=self.schema)
+
+    def lookup(self, raw):
+        """install_key of each (n, 32) uint8 id, -1 for unknown ones."""
+        keys = np.full(len(raw), -1, dtype=np.int32)
+        prefix = prefixes(raw)
+        # Sorted needles make the binary searches walk the index in order.
+        pos = np.empty(len(raw), dtype=np.int64)
+        order = np.argsort(prefix)
+        pos[order] = np.searchsorted(self.prefixes, prefix[order])
+        pending = np.flatnonzero(pos < len(self.prefixes))
+        # Ids sharing a prefix are adjacent: step through them until the whole id matches.
+        while len(pending):
+            pending = pending[self.prefixes[pos[pending]] == prefix[pending]]
+            candidate = self.order[pos[pending]]
+            hit = (self.raw[candidate] == raw[pending]).all(axis=1)
+            keys[pending[hit]] = candidate[hit]
+            pending = pending[~hit]
+            pos[pending] += 1
+            pending = pending[pos[pending] < len(self.prefixes)]
+        return keys
+
+    def append(self, new):
+        """Give the distinct, unknown (n, 32) uint8 ids ``new`` the next keys, in order, and return those."""
+        keys = len(self) + np.arange(len(new), dtype=np.int32)
+        # Grow the id matrix geometrically, so a day at a time does not copy it every time.
+        if len(self._buffer) < len(self) + len(new):
+            self._buffer = np.concatenate([self.raw, np.empty((max(len(self), len(new)), ID_BYTES), np.uint8)])
+        self._buffer[len(self):len(self) + len(new)] = new
+        self.raw = self._buffer[:len(self) + len(new)]
+        prefix = prefixes(new)
+        order = np.argsort(prefix, kind="stable")
+        at = np.searchsorted(self.prefixes, prefix[order])
+        self.prefixes = np.insert(self.prefixes, at, prefix[order])
+        self.order = np.insert(self.order, at, keys[order])
+        return keys
+
+    def encode(self, ids, add: bool = True):
+        """Map hex ids to install keys; unknown ids get new keys, or -1 when ``add`` is False."""
+        if isinstance(ids, pa.ChunkedArray):
+            ids = ids.combine_chunks()
+        # Every distinct id of the batch, in order of first appearance, is converted and looked up once.
+        encoded = pc.dictionary_encode(pc.utf8_lower(ids.cast(pa.string())))
+        raw = hex_to_bytes(encoded.dictionary)
+        keys = self.lookup(raw)
+        missing = keys < 0
+        if add and missing.any():
+            keys[missing] = self.append(raw[missing])
+        # Null ids get the trailing -1.
+        keys = np.append(keys, np.int32(-1))
+        indices = pc.fill_null(encoded.indices, len(raw)).to_numpy(zero_copy_only=False)
+        return pa.array(keys[indices], pa.int32())
@@ -0,0 +1,69 @@
+"""The report's metrics, computed without Streamlit.
+
+Everything the report shows as a number or a daily series is defined here on
+top of the cached aggregates of data.py, so the report, the HTTP service in
+server.py and any other job compute them the same way from the same shared
+data. Every function takes optional ``slicer.Filters``.
+"""
+import pandas as pd
+
+import anomalies
+import data
+import slicer
+
+# Daily series by name: (function of data.py, value column).
+SERIES = {
+    "ads_spend": (data.ads_by_date, "daily_ads_spend"),
+    "installs": (data.installs_by_date, "daily_installs"),
+    "payouts": (data.payouts_by_date, "daily_payouts"),
+    "revenue": (data.revenue_by_date, "daily_revenue"),
+}
+
+
+def daily_profit(filters=None):
+    """Daily revenue minus payouts and ads spend, matched on event_date; a day without payouts or spend counts as 0."""
+    profit = data.revenue_by_date(filters).set_index('event_date')['daily_revenue']
+    profit = profit.sub(data.payouts_by_date(filters).set_index('event_date')['daily_payouts'], fill_value=0)
+    profit = profit.sub(data.ads_by_date(filters).set_index('event_date')['daily_ads_spend'], fill_value=0)
+    return profit.reset_index(name='daily_profit')
+
+
+def daily(filters=None):
+    """All daily series side by side, one row per event_date; NaN where a series has no rows that day."""
+    frames = [function(filters).set_index('event_date')[column] for function, column in SERIES.values()]
+    frames.append(daily_profit(filters).set_index('event_date')['daily_profit'])
+    return pd.concat(frames, axis=1).sort_index().reset_index()
+
+
+def series(name: str, filters=None):
+    """The daily ``name`` series (a SERIES name or "profit") by event_date."""
+    if name == "profit":
+        return daily_profit(filters).set_index('event_date')['daily_profit']
+    function, column = SERIES[name]
+    return function(filters).set_index('event_date')[column]
+
+
+def scan(name: str, filters=None):
+    """Anomaly scan (see anomalies.py) of the daily ``name`` series of the selected segments, over all dates."""
+    filters = slicer.normalize(filters)._replace(start=None, end=None)
+    return data.cached_view(f"scan[{name}]", filters,
+                            lambda: anomalies.scan_series(series(name, filters), data.cube_index().dates()))
+
+
+def insights(name: str, filters=None):
+    """Bullets on the daily ``name`` series of the selection: totals, seasonality, spikes, dips and shifts."""
+    return data.cached_view(f"insights[{name}]", filters, lambda: anomalies.describe(
+        name, series(name, filters), scan(name, filters), data.segment_anomalies(name), filters))
+
+
+def kpis(filters=None):
+    """Totals, profit, profit margin (in %) and per-install and per-day averages."""
+    result = dict(data.totals(filters))
+    profit = result["total_revenue"] - result["total_payouts"] - result["total_ads_spend"]
+    result["total_profit"] = profit
+    result["profit_margin"] = profit / result["total_revenue"] * 100 if result["total_revenue"] else 0.0
+    result["avg_profit_per_install"] = profit / result["total_installs"] if result["total_installs"] else 0.0
+    for name, (function, column) in SERIES.items():
+        series = function(filters)[column]
+        result[f"avg_daily_{name}"] = float(series.mean()) if len(series) else 0.0
+    return result
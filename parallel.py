@@ -0,0 +1,90 @@
+"""Parallel streaming aggregation over a process pool.
+
+    python parallel.py [max_workers]
+
+Every table is split into slices of whole Parquet row groups, and each slice
+is streamed through its own ``stream.Aggregator`` in a worker process, so the
+four tables and the parts of the big revenue table are decoded and
+aggregated at the same time. The per-slice partials are merged in the parent
+in slice order, which keeps the result independent of scheduling.
+``JUSTDICE_WORKERS`` sets the pool size (default: one per CPU; 1 runs
+everything in-process).
+
+Run as a script it builds the cube aggregates with 1, 2, 4, ... workers up
+to ``max_workers`` and prints the wall time and speedup of each.
+"""
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow.parquet as pq
+
+import ingest
+import stream
+
+WORKERS = int(os.environ.get("JUSTDICE_WORKERS", "0")) or os.cpu_count() or 1
+
+
+def slices(table: str, parts: int):
+    """Split the row groups of an ingested table into at most ``parts`` contiguous slices.
+
+    Each slice is a list of (path, row_groups) pairs over stream.table_paths(),
+    the files every other reader of the table uses.
+    """
+    groups = [(path, group) for path in stream.table_paths(table)
+              for group in range(pq.ParquetFile(path).num_row_groups)]
+    if not groups:
+        return [[]]  # one empty slice, so the table still gets an (empty) aggregate
+    result = []
+    for s in np.array_split(np.arange(len(groups)), min(parts, len(groups))):
+        runs = itertools.groupby((groups[i] for i in s), key=lambda group: group[0])
+        result.append([(path, [group for _, group in run]) for path, run in runs])
+    return result
+
+def aggregate(jobs, workers=None, chunk_mb=None):
+    """Run ``stream.aggregate(**job)`` for every job in ``jobs`` ({name: job}), split across workers.
+
+    Returns {name: Aggregator}.
+    """
+    workers = WORKERS if workers is None else workers
+    tasks = [(name, dict(job, chunk_mb=chunk_mb, parts=parts))
+             for name, job in jobs.items() for parts in slices(job["table"], workers)]
+    if workers <= 1:
+        partials = [stream.aggregate(**task) for _, task in tasks]
+    else:
+        # spawn, not fork: the report runs this from a threaded server process.
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(min(workers, len(tasks)), mp_context=context) as pool:
+            futures = [pool.submit(stream.aggregate, **task) for _, task in tasks]
+            partials = [future.result() for future in futures]
+    results = {}
+    for (name, _), partial in zip(tasks, partials):
+        results[name] = results[name].merge(partial) if name in results else partial
+    return results
+
+
+def benchmark(max_workers: int, repeat: int = 3):
+    """Best wall time of a full cube aggregation for 1, 2, 4, ... ``max_workers`` workers."""
+    import cube
+
+    counts = sorted({min(2 ** i, max_workers) for i in range(max_workers.bit_length() + 1)})
+    timings = {}
+    for workers in counts:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cube.build_cube(workers=workers)
+            best = min(best, time.perf_counter() - start)
+        timings[workers] = best
+    return timings
+
+
+if __name__ == "__main__":
+    ingest.ingest()
+    timings = benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else WORKERS)
+    for workers, seconds in timings.items():
+        print(f"{workers:>3} workers: {seconds:7.3f}s  speedup {timings[1] / seconds:5.2f}x")
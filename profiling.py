@@ -0,0 +1,126 @@
+"""Per-section profiling of report runs.
+
+report.py calls ``begin_run()`` first, ``section(name)`` where each of its
+sections starts (which also ends the previous one), ``rows(n)`` for the rows
+a section processes, and ``end_run()`` at the end. For every section of
+every run this records wall time, CPU time of the session's thread, rows and
+the change in the process's resident memory, and logs it as one JSON line
+on the ``profiling`` logger. That logger, and the one of startup.py, write
+to ``JUSTDICE_PROFILE_LOG``: stderr for ``-`` (the default), else a file
+path; an empty value leaves them to the application's logging setup.
+
+Records of the last ``JUSTDICE_PROFILE_RUNS`` runs (default 200) are kept in
+memory, shared by all sessions of the process, for the diagnostics page of
+the report (``?diagnostics`` in the URL, shown when
+``JUSTDICE_DIAGNOSTICS=1``), which summarizes them as percentiles per
+section. Memory is process-wide, so with concurrent sessions a section's
+delta includes what other sessions allocated meanwhile.
+"""
+import itertools
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from collections import deque
+
+RUNS = int(os.environ.get("JUSTDICE_PROFILE_RUNS", "200"))
+DIAGNOSTICS = os.environ.get("JUSTDICE_DIAGNOSTICS", "0") == "1"
+PERCENTILES = [0.5, 0.9, 0.99]
+LOG_TARGET = os.environ.get("JUSTDICE_PROFILE_LOG", "-")
+
+
+def configure_log(logger: logging.Logger):
+    """Write the INFO records of ``logger`` to ``JUSTDICE_PROFILE_LOG``, unless it is empty."""
+    if not LOG_TARGET:
+        return
+    handler = logging.StreamHandler(sys.stderr) if LOG_TARGET == "-" else logging.FileHandler(LOG_TARGET)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+log = logging.getLogger(__name__)
+configure_log(log)
+
+_records = deque(maxlen=RUNS * 16)  # about 16 sections per run
+_run_ids = itertools.count(1)
+# State of the current report run: Streamlit runs every session's script in its own thread.
+# startup.py keeps its stage timings here too.
+run_state = threading.local()
+
+
+def rss_mb():
+    """Resident memory of the process in MB (peak resident memory where /proc is not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def begin_run():
+    run_state.id = next(_run_ids)
+    run_state.section = None
+
+
+def _close():
+    current = getattr(run_state, "section", None)
+    if current is None:
+        return
+    name, wall, cpu, rss, rows = current
+    record = {
+        "run": run_state.id,
+        "section": name,
+        "time": time.time(),
+        "wall_ms": round((time.perf_counter() - wall) * 1000, 2),
+        "cpu_ms": round((time.thread_time() - cpu) * 1000, 2),
+        "rows": rows,
+        "memory_delta_mb": round(rss_mb() - rss, 2),
+    }
+    _records.append(record)
+    log.info(json.dumps(record))
+    run_state.section = None
+
+
+def section(name: str):
+    """End the current section of this run, if any, and start timing ``name``."""
+    if getattr(run_state, "id", None) is None:
+        return
+    _close()
+    run_state.section = [name, time.perf_counter(), time.thread_time(), rss_mb(), 0]
+
+
+def rows(n: int):
+    """Count ``n`` more rows as processed by the current section."""
+    current = getattr(run_state, "section", None)
+    if current is not None:
+        current[4] += int(n)
+
+
+def end_run():
+    if getattr(run_state, "id", None) is None:
+        return
+    _close()
+    run_state.id = None
+
+
+def records():
+    """The recorded sections of recent runs, oldest first."""
+    return list(_records)
+
+
+def percentiles():
+    """Per section: number of runs and percentiles of wall time, CPU time, rows and memory delta."""
+    import pandas as pd
+
+    measures = ["wall_ms", "cpu_ms", "rows", "memory_delta_mb"]
+    df = pd.DataFrame(records(), columns=["run", "section", "time", *measures]).astype(dict.fromkeys(measures, float))
+    stats = df.groupby("section", sort=False)[measures].quantile(PERCENTILES)
+    stats = stats.unstack().reindex(columns=pd.MultiIndex.from_product([measures, PERCENTILES]))
+    stats.columns = [f"{column}_p{int(q * 100)}" for column, q in stats.columns]
+    stats.insert(0, "runs", df.groupby("section", sort=False).size())
+    return stats.sort_values("wall_ms_p50", ascending=False)
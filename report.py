@@ -1,26 +1,38 @@
+import startup
+startup.begin()
+
 import streamlit as st
-import pandas as pd
-import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
-import streamlit_lottie as st_lottie
-import requests
+import assets
+import profiling
 
 st.set_page_config(page_title="JustDice Financial Analysis", page_icon="📈", layout="wide")
-
-# Define a function that we can use to load lottie files from a link.
-def load_lottieurl(url: str):
-    r = requests.get(url)
-    if r.status_code != 200:
-        return None
-    return r.json()
-
-lottie = load_lottieurl("https://assets2.lottiefiles.com/packages/lf20_49rdyysj.json")
+startup.mark("imports")
+
+# Hidden diagnostics page (?diagnostics in the URL, enabled by JUSTDICE_DIAGNOSTICS=1): timings of the report's
+# sections over recent runs of this process, instead of the report.
+if profiling.DIAGNOSTICS and "diagnostics" in st.experimental_get_query_params():
+    st.title("🩺 Diagnostics")
+    st.markdown(f"Percentiles per section over the last {profiling.RUNS} runs of this process (see profiling.py).")
+    st.dataframe(profiling.percentiles())
+    st.subheader("Recent sections")
+    st.dataframe(profiling.records()[::-1][:200])
+    st.stop()
+
+# Every section of the report is timed (see profiling.py).
+profiling.begin_run()
+profiling.section("header")
+
+# The animation is bundled with the repository and read once per process (see assets.py), so the page never waits
+# on the network.
+lottie = assets.lottie()
 
 col_lottie, col_title = st.columns([1, 3])
 
-with col_lottie:
-    st_lottie.st_lottie(lottie, width=200, height=200)
+if lottie is not None:
+    import streamlit_lottie as st_lottie
+
+    with col_lottie:
+        st_lottie.st_lottie(lottie, width=200, height=200)
 
 with col_title:
     st.title("JustDice Financial Analysis")
@@ -30,23 +42,54 @@ with col_title:
     - The report includes several interactive charts and graphs to illustrate key findings and provide a visual representation of the data.
     - Overall, this report provides insights into JustDice's financial performance and can be used to inform future business decisions.
     """)
+startup.mark("first_paint")
+
+profiling.section("imports")
+
+# The data layer and plotting libraries are imported after the header so that it is on the page while they load.
+import pandas as pd
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+import charts
+import cohorts
+import data
+import metrics
+import sketch
+import slicer
+import uniques
+
+# FILTERS
+profiling.section("filters")
+# Every chart and KPI below covers the selection in the sidebar. Filtering slices the indexed cube (see slicer.py)
+# instead of regrouping data, so a widget change only costs a few small reductions.
+st.sidebar.header("🔎 Filters")
+first_date, last_date = data.date_bounds()
+date_range = st.sidebar.date_input('Date range', (first_date, last_date), min_value=first_date, max_value=last_date)
+# While a range is being picked (or after it is cleared) the widget holds fewer than two dates: show everything.
+start_date, end_date = date_range if len(date_range) == 2 else (first_date, last_date)
+segment_values = data.segment_values()
+filter_countries = st.sidebar.multiselect('Country', segment_values['country_id'])
+filter_apps = st.sidebar.multiselect('App', segment_values['app_id'])
+filter_networks = st.sidebar.multiselect('Network', segment_values['network_id'])
+filters = slicer.Filters(start_date, end_date, filter_countries, filter_apps, filter_networks)
+
+
+def insight_bullets(name, notes=()):
+    # Bullets on the selection's daily series generated from the data (see anomalies.py), followed by fixed notes.
+    return "\n".join(f"- {line}" for line in [*metrics.insights(name, filters), *notes])
+
+# Totals, profit and averages of the selection, computed by the same engine the metrics API serves (see metrics.py)
+kpis = metrics.kpis(filters)
 
 # INVESTIGATE ADS SPEND DATA
-ads = pd.read_csv("adspend.csv")
-ads['event_date'] = pd.to_datetime(ads['event_date'], format='%Y-%m-%d')
-# Round value_usd to 2 decimal places
-ads['value_usd'] = ads['value_usd'].round(2)
-
-# Calculate sum of ads value_usd by date
-ads_by_date = ads.groupby('event_date')['value_usd'].sum()
-# Name  columns as event_date and daily ads spend
-ads_by_date = ads_by_date.reset_index()
-ads_by_date.columns = ['event_date', 'daily_ads_spend']
-# Round daily_ads_spend to 2 decimal places
-ads_by_date['daily_ads_spend'] = ads_by_date['daily_ads_spend'].round(2)
-
-# Calculate total daily_ads_spend
-total_ads_spend = ads_by_date['daily_ads_spend'].sum()
+profiling.section("ads_spend")
+# Daily ads spend, rounded to 2 decimal places (cached across reruns and sessions in data.py)
+ads_by_date = data.ads_by_date(filters)
+profiling.rows(len(ads_by_date))
+
+# Total daily_ads_spend, kept up to date with the cube (see cube.py)
+total_ads_spend = kpis['total_ads_spend']
 
 # min and max daily ads spend
 min_ads_spend = ads_by_date['daily_ads_spend'].min()
@@ -54,77 +97,54 @@ max_ads_spend = ads_by_date['daily_ads_spend'].max()
 
 col1, col2 = st.columns(2)
 with col1:
-    fig_ads = px.line(ads_by_date, x='event_date', y='daily_ads_spend', title='Daily Ads Spend', labels={'event_date':'Date', 'daily_ads_spend':'Daily Ads Spend ($)'})
-    fig_ads.add_annotation(x=ads_by_date['event_date'].max(), y=ads_by_date['daily_ads_spend'].max(), text=f"Total Ads Spend: ${total_ads_spend:,.2f}", showarrow=False)
-    fig_ads.update_layout(annotations=[dict(x=0, y=1, xref='paper', yref='paper', xanchor='left', yanchor='bottom', showarrow=False, font=dict(size=14, color='black', family='Arial'))])
-    st.plotly_chart(fig_ads)
-
-    st.markdown("""
-    - The chart shows daily ads spend data for the year 2022.
-    - There are clear fluctuations in ads spend throughout the year, with some months having higher ads spend compared to others.
-    - The highest ads spend occurs in November, followed by August, January.
-    - The lowest ads spend occurs in March, followed by April, June and October.
-    - The dip in ads spend in mid-March and mid-April could be related to a seasonal slowdown or a change in marketing strategy.
-    - The downward trend in ads spend after the peak in mid-November, along with the fluctuations observed during this time, suggest that there may have been changes in marketing goals or campaigns that impacted ads spend and resulted in a decrease in spending over time.
-    - Identifying external factors that may influence ads spend and app usage, such as events, seasonality, or industry trends, can help explain fluctuations in the data and inform future marketing efforts.
-    """)
+    # Line charts are downsampled and cached per data version and filters (see charts.py).
+    def build_fig_ads():
+        fig_ads = charts.line(ads_by_date, x='event_date', y='daily_ads_spend', title='Daily Ads Spend', labels={'event_date':'Date', 'daily_ads_spend':'Daily Ads Spend ($)'})
+        fig_ads.add_annotation(x=ads_by_date['event_date'].max(), y=ads_by_date['daily_ads_spend'].max(), text=f"Total Ads Spend: ${total_ads_spend:,.2f}", showarrow=False)
+        fig_ads.update_layout(annotations=[dict(x=0, y=1, xref='paper', yref='paper', xanchor='left', yanchor='bottom', showarrow=False, font=dict(size=14, color='black', family='Arial'))])
+        return fig_ads
+    fig_ads = charts.figure("fig_ads", filters, build_fig_ads)
+    charts.plotly_chart(fig_ads)
+
+    st.markdown(insight_bullets('ads_spend', [
+        "Identifying external factors that may influence ads spend and app usage, such as events, seasonality, or industry trends, can help explain fluctuations in the data and inform future marketing efforts.",
+    ]))
 
     
 # INVESTIGATE INSTALLS DATA
-installs = pd.read_csv("installs.csv")
-installs['event_date'] = pd.to_datetime(installs['event_date'], format='%Y-%m-%d')
-
-# Calculate sum of installs by date
-installs_by_date = installs.groupby('event_date').size().reset_index(name='daily_installs')
-
-# Make sure the event_date column is a date
-installs_by_date['event_date'] = pd.to_datetime(installs_by_date['event_date'])
+profiling.section("installs")
+# Number of installs by date
+installs_by_date = data.installs_by_date(filters)
+profiling.rows(len(installs_by_date))
 
-total_installs = installs_by_date['daily_installs'].sum()
+total_installs = kpis['total_installs']
 
 # Min and max installs
 min_installs = installs_by_date['daily_installs'].min()
 max_installs = installs_by_date['daily_installs'].max()
 
 with col2:
-    fig_installs = px.line(installs_by_date, x='event_date', y='daily_installs', title='Daily Installs', labels={'event_date':'Date', 'daily_installs':'Daily Installs'})
-    fig_installs.add_annotation(x=installs_by_date['event_date'].max(), y=installs_by_date['daily_installs'].max(), text=f"Total Installs: {total_installs:,.0f}", showarrow=False)
-    fig_installs.update_layout(annotations=[dict(x=0, y=1, xref='paper', yref='paper', xanchor='left', yanchor='bottom', showarrow=False, font=dict(size=14, color='black', family='Arial'))])
-    st.plotly_chart(fig_installs)
+    def build_fig_installs():
+        fig_installs = charts.line(installs_by_date, x='event_date', y='daily_installs', title='Daily Installs', labels={'event_date':'Date', 'daily_installs':'Daily Installs'})
+        fig_installs.add_annotation(x=installs_by_date['event_date'].max(), y=installs_by_date['daily_installs'].max(), text=f"Total Installs: {total_installs:,.0f}", showarrow=False)
+        fig_installs.update_layout(annotations=[dict(x=0, y=1, xref='paper', yref='paper', xanchor='left', yanchor='bottom', showarrow=False, font=dict(size=14, color='black', family='Arial'))])
+        return fig_installs
+    fig_installs = charts.figure("fig_installs", filters, build_fig_installs)
+    charts.plotly_chart(fig_installs)
 
-    st.markdown("""
-    - The line chart shows the daily installs of our apps or our partner companies apps over the course of the year 2022, with fluctuations from month to month.
-    - There were dips in daily installs in January, March and April, followed by an increase in late May and then a more consistent upward trend from June to August, reaching a peak of around 1400 daily installs in mid-November.
-    - After August, there was a fluctuation and downward trend in daily installs for the remaining months of the year, reaching around 500 daily installs by December.
-    - These fluctuations in daily installs suggest that there may have been external factors at play, such as changes in consumer behavior or shifts in the competitive landscape.
-    - Further investigation into the factors driving the increase in daily installs from June to August could provide valuable insights into effective marketing campaigns or other factors that could be replicated in the future.
-    - Exploring the reasons for the subsequent decline in daily installs could help identify potential areas for improvement.
-    - The chart highlights the importance of monitoring daily installs over time and identifying trends and patterns that can inform strategic decision-making.
-    - It may be valuable to analyze the daily installs in comparison to competitors, to gain a better understanding of the product's position in the market.
-    """)
+    st.markdown(insight_bullets('installs', [
+        "Exploring what drove the spikes, dips and shifts in daily installs could show which campaigns to repeat and where to improve.",
+        "It may be valuable to analyze the daily installs in comparison to competitors, to gain a better understanding of the product's position in the market.",
+    ]))
 
 
-# Calculate sum of installs by date and country_id
-installs_by_date_country = installs.groupby(['event_date', 'country_id']).size().reset_index(name='daily_installs')
+profiling.section("country_app")
+# Total installs for each country_id
+installs_by_country = data.installs_by_country(filters)
 
-# Make sure the event_date column is a date
-installs_by_date_country['event_date'] = pd.to_datetime(installs_by_date_country['event_date'])
-
-# Calculate sum of daily_install for each country_id and sort by descending order
-installs_by_country = installs_by_date_country.groupby('country_id')['daily_installs'].sum().reset_index()
-# Change daily_installs column name to total_installs
-installs_by_country.columns = ['country_id', 'total_installs']
-
-# Calculate sum of installs by date and app_id
-installs_by_app = installs.groupby(['event_date', 'app_id']).size().reset_index(name='daily_installs')
-
-# Make sure the event_date column is a date
-installs_by_app['event_date'] = pd.to_datetime(installs_by_app['event_date'], format='%Y-%m-%d')
-
-# Calculate sum of daily_install for each country_id and sort by descending order
-total_installs_by_app = installs_by_app.groupby('app_id')['daily_installs'].sum().reset_index().sort_values('daily_installs', ascending=False)
-# Change daily_installs column name to total_installs
-total_installs_by_app.columns = ['app_id', 'total_installs']
+# Total installs for each app_id, sorted by descending order
+total_installs_by_app = data.installs_by_app(filters)
+profiling.rows(len(installs_by_country) + len(total_installs_by_app))
 
 
 col3, col4 = st.columns(2)
@@ -133,14 +153,15 @@ with col3:
     fig_installs_by_country = px.pie(installs_by_country, values='total_installs', names='country_id', title='Total Installs by Country')
     st.plotly_chart(fig_installs_by_country)
 
-    st.markdown("""
-    - The chart displays the percentage of total installs by country_id, with four different country_ids represented.
-    - The chart shows that country_id=1 has a significantly higher percentage of total installs compared to the other countries, with over 60% of all installs coming from this country.
-    - The second most popular country for installs is country_id=109, with just over 28% of all installs.
-    - Country_id=17 and country_id=213 have much smaller percentages of total installs, at 4.92% and 4.12%, respectively.
-    - Based on this data, it appears that country_id=1 is the most popular country for installs and could be a target for future marketing and growth efforts.
-    - Additionally, there could be potential for growth in countries with smaller percentages of total installs, such as country_id=17 and country_id=213.
-    - It could be useful to investigate why country_id=1 is the most popular country for installs and whether there are specific factors contributing to this trend.
+    # Share of installs of each country, largest first, for the commentary.
+    country_shares = installs_by_country.set_index('country_id')['total_installs'].sort_values(ascending=False)
+    country_shares = country_shares / max(country_shares.sum(), 1)
+    top_countries = ", ".join(f"country_id={country} with {share:.2%}" for country, share in country_shares.iloc[:4].items())
+    st.markdown(f"""
+    - The chart displays the percentage of total installs by country_id, with {len(country_shares)} different country_ids represented.
+    - The countries with the most installs are {top_countries or 'none in this selection'}.
+    - The most popular country for installs could be a target for future marketing and growth efforts, and there could be potential for growth in countries with smaller percentages of total installs.
+    - It could be useful to investigate why the most popular country has the most installs and whether there are specific factors contributing to this trend.
     - Further analysis could involve comparing these results to data from previous time periods or from similar products or services to determine if there are any significant changes or trends over time or across different products or services.
     """)
 
@@ -149,9 +170,13 @@ with col4:
     fig_installs_by_app = px.pie(total_installs_by_app, values='total_installs', names='app_id', title='Total Installs by App')
     st.plotly_chart(fig_installs_by_app)
 
-    st.markdown("""
+    # Share of installs of each app, largest first, for the commentary.
+    app_shares = total_installs_by_app.set_index('app_id')['total_installs'].sort_values(ascending=False)
+    app_shares = app_shares / max(app_shares.sum(), 1)
+    top_apps = ", ".join(f"app ID {app} with {share:.2%}" for app, share in app_shares.iloc[:5].items())
+    st.markdown(f"""
     - The pie chart displays the percentage of app installs for different apps
-    - The top 5 app installs by app ID are app ID 174 with 21.9%, app ID 121 with 18.4%, app ID 94 with 14.9%, app ID 189 with 4.65%, and app ID 71 with 3.83%.
+    - The top {min(len(app_shares), 5)} app installs by app ID are {top_apps or 'none in this selection'}.
     - The data suggests that there are a few apps that are particularly popular among users. These apps may be worth investing in further or promoting more heavily.
     - It's important to note that there are many other app IDs with smaller percentages of installs, indicating that there may be opportunities for growth and improvement among these apps as well.
     - We should consider factors such as the type of app and the target audience when analyzing the data. For example, certain apps may be more popular among younger or older users, or may be more popular in certain geographic regions.
@@ -159,84 +184,68 @@ with col4:
     """)
 
 # INVESTIGATE PAYOUTS DATA
-payouts = pd.read_csv('payouts.csv')
-payouts['event_date'] = pd.to_datetime(payouts['event_date'], format='%Y-%m-%d')
-
-# Calculate sum of payouts value_usd by date
-payouts_by_date = payouts.groupby('event_date')['value_usd'].sum().reset_index()
-# Name  columns as event_date and daily ads spend
-payouts_by_date.columns = ['event_date', 'daily_payouts']
-# Round daily_payouts to 2 decimal places
-payouts_by_date['daily_payouts'] = payouts_by_date['daily_payouts'].round(2)
+profiling.section("payouts")
+# Daily payouts, rounded to 2 decimal places
+payouts_by_date = data.payouts_by_date(filters)
+profiling.rows(len(payouts_by_date))
 
 # Calculate total payouts
-total_payouts = payouts_by_date['daily_payouts'].sum()
+total_payouts = kpis['total_payouts']
 
 # Calculate min, max, and average daily payouts
 min_daily_payouts = payouts_by_date['daily_payouts'].min()
 max_daily_payouts = payouts_by_date['daily_payouts'].max()
-avg_daily_payouts = payouts_by_date['daily_payouts'].mean()
+avg_daily_payouts = kpis['avg_daily_payouts']
 
 col5, col6 = st.columns(2)
 with col5:
-    # Visualize daily payouts by date in a line chart
-    fig_payouts = px.line(payouts_by_date, x='event_date', y='daily_payouts', title='Daily Payouts', labels={'event_date':'Date', 'daily_payouts':'Daily Payouts ($)'})
-    # Add annotations to the chart to show total payouts and average daily payouts 
-    fig_payouts.add_annotation(x=0, y=1, xref='paper', yref='paper', xanchor='left', yanchor='bottom', showarrow=False, text=f"Total Payouts: ${total_payouts:,.2f}", font=dict(size=14, color='black', family='Arial'))
-    fig_payouts.add_annotation(x=0.9, y=1, xref='paper', yref='paper', xanchor='right', yanchor='bottom', showarrow=False, text=f"Average Daily Payouts: ${avg_daily_payouts:,.2f}", font=dict(size=14, color='black', family='Arial'))
-    st.plotly_chart(fig_payouts)
+    def build_fig_payouts():
+        # Visualize daily payouts by date in a line chart
+        fig_payouts = charts.line(payouts_by_date, x='event_date', y='daily_payouts', title='Daily Payouts', labels={'event_date':'Date', 'daily_payouts':'Daily Payouts ($)'})
+        # Add annotations to the chart to show total payouts and average daily payouts
+        fig_payouts.add_annotation(x=0, y=1, xref='paper', yref='paper', xanchor='left', yanchor='bottom', showarrow=False, text=f"Total Payouts: ${total_payouts:,.2f}", font=dict(size=14, color='black', family='Arial'))
+        fig_payouts.add_annotation(x=0.9, y=1, xref='paper', yref='paper', xanchor='right', yanchor='bottom', showarrow=False, text=f"Average Daily Payouts: ${avg_daily_payouts:,.2f}", font=dict(size=14, color='black', family='Arial'))
+        return fig_payouts
+    fig_payouts = charts.figure("fig_payouts", filters, build_fig_payouts)
+    charts.plotly_chart(fig_payouts)
 
-    st.markdown("""
-    - The chart displays the daily payouts of the company for the year 2022.
-    - There is a general upward trend in the daily payout amounts over time, indicating that the number of users installing our apps or our partner companies apps is increasing.
-    - However, the fluctuations in the payout amounts over time do not appear to follow a consistent pattern. Rather, they may be due to various factors such as changes in the market, fluctuations in customer behavior or changes in the company's payout policies.
-    - There does not appear to be a clear seasonal pattern in the payout amounts over time.
-    - The company's payout strategy appears to be successful in attracting new customers and retaining existing ones.
-    - It may be useful to conduct further analysis to identify factors driving fluctuations in the payout amounts and to assess the long-term sustainability of the company's payout strategy.
-    """)
+    st.markdown(insight_bullets('payouts', [
+        "It may be useful to conduct further analysis to identify factors driving fluctuations in the payout amounts and to assess the long-term sustainability of the company's payout strategy.",
+    ]))
 
 
 
 # INVESTIGATE REVENUE DATA
-revenue = pd.read_csv('revenue.csv')
-revenue['event_date'] = pd.to_datetime(revenue['event_date'], format='%Y-%m-%d')
-
-#  Calculate sum of revenue value_usd by date
-revenue_by_date = revenue.groupby('event_date')['value_usd'].sum().reset_index()
-# Name  columns as event_date and daily revenue
-revenue_by_date.columns = ['event_date', 'daily_revenue']
-# Round daily_revenue to 2 decimal places
-revenue_by_date['daily_revenue'] = revenue_by_date['daily_revenue'].round(2)
+profiling.section("revenue")
+# Daily revenue, rounded to 2 decimal places
+revenue_by_date = data.revenue_by_date(filters)
+profiling.rows(len(revenue_by_date))
 
 # Calculate total revenue
-total_revenue = revenue_by_date['daily_revenue'].sum()
+total_revenue = kpis['total_revenue']
 # Calculate average daily revenue
-avg_daily_revenue = revenue_by_date['daily_revenue'].mean()
+avg_daily_revenue = kpis['avg_daily_revenue']
 
 
 
 with col6:
-    # Visualize daily revenue by date in a line chart
-    fig_revenue = px.line(revenue_by_date, x='event_date', y='daily_revenue', title='Daily Revenue', labels={'event_date':'Date', 'daily_revenue':'Daily Revenue ($)'})
-    # Add average daily revenue annotation to top right of chart
-    fig_revenue.add_annotation(x=1, y=1, xref='paper', yref='paper', xanchor='right', yanchor='bottom', text=f"Average Daily Revenue: ${avg_daily_revenue:,.2f}", showarrow=False, font=dict(size=14, color='black', family='Arial'))
-    # Add total revenue annotation to top left of chart
-    fig_revenue.add_annotation(x=0, y=1, xref='paper', yref='paper', xanchor='left', yanchor='bottom', text=f"Total Revenue: ${total_revenue:,.2f}", showarrow=False, font=dict(size=14, color='black', family='Arial'))
-    st.plotly_chart(fig_revenue)
-
-    st.markdown("""
-    - The chart displays the daily revenue of the company for the year 2022.
-    - The daily revenue ranges between \\$387.22 and \\$2,973.45, with an average of $1,147.52 per day.
-    - The chart shows that the company's daily revenue is fairly consistent throughout the year, but there are notable exceptions.
-    - The daily revenue dips significantly below the average in mid-April, early June, mid-October and late December.
-    - The daily revenue spikes above the average in late February, late May, late July, mid-November.
-    - Towards the end of the year, there appears to be a general trend of decreasing daily revenue, with the lowest revenue occurring in late December.
-    - The wide range of daily revenue suggests that there may be a high degree of variability in the factors that influence revenue from day to day.
-    - We may want to investigate the factors that are driving the days with the highest and lowest revenue in order to better understand what is contributing to the variability.
-    - It may be useful to compare this year's revenue to previous years in order to see if there are any significant changes or trends over time.
-    - We may also want to investigate any external factors that may have influenced the revenue, such as changes in the industry or economy, major events or announcements, etc.
-    """)
-
+    def build_fig_revenue():
+        # Visualize daily revenue by date in a line chart
+        fig_revenue = charts.line(revenue_by_date, x='event_date', y='daily_revenue', title='Daily Revenue', labels={'event_date':'Date', 'daily_revenue':'Daily Revenue ($)'})
+        # Add average daily revenue annotation to top right of chart
+        fig_revenue.add_annotation(x=1, y=1, xref='paper', yref='paper', xanchor='right', yanchor='bottom', text=f"Average Daily Revenue: ${avg_daily_revenue:,.2f}", showarrow=False, font=dict(size=14, color='black', family='Arial'))
+        # Add total revenue annotation to top left of chart
+        fig_revenue.add_annotation(x=0, y=1, xref='paper', yref='paper', xanchor='left', yanchor='bottom', text=f"Total Revenue: ${total_revenue:,.2f}", showarrow=False, font=dict(size=14, color='black', family='Arial'))
+        return fig_revenue
+    fig_revenue = charts.figure("fig_revenue", filters, build_fig_revenue)
+    charts.plotly_chart(fig_revenue)
+
+    st.markdown(insight_bullets('revenue', [
+        "We may want to investigate the factors that are driving the days with the highest and lowest revenue in order to better understand what is contributing to the variability.",
+        "We may also want to investigate any external factors that may have influenced the revenue, such as changes in the industry or economy, major events or announcements, etc.",
+    ]))
+
+profiling.section("totals")
 # Create a dataframe with total ads spend, total payouts, and total revenue
 total = pd.DataFrame({'total_ads_spend': [total_ads_spend], 'total_payouts': [total_payouts], 'total_revenue': [total_revenue]})
 
@@ -258,28 +267,30 @@ with col7:
     fig_total.update_layout(title_text='Total Revenue, Payouts and Ads Spend')
     st.plotly_chart(fig_total)
 
-    st.markdown("""
+    # Ads spend as a share of all costs, for the commentary.
+    total_costs = total_ads_spend + total_payouts
+    ads_share = total_ads_spend / total_costs if total_costs else 0.0
+    st.markdown(f"""
     - The chart displays a bar graph with three bars representing the total revenue, total ads spend, and total payouts for our company.
-    - The total revenue for our company is \\$418,845.29, which is the highest value among the three bars. This indicates that our company generates more revenue than it spends on advertising or payouts.
-    - The total ads spend for our company is \\$254,075.99, which is significantly higher than the total payouts of $62,320.97. This suggests that we are investing heavily in advertising in order to generate revenue.
-    - The profit margin for our company can be calculated by subtracting the total ads spend and payouts from the total revenue. In this case, our profit margin is $102,448.33, representing approximately 24.46% of our total revenue.
+    - The total revenue for our company is \\${total_revenue:,.2f}, {'more' if total_revenue > total_costs else 'less'} than the \\${total_costs:,.2f} it spent on advertising and payouts together.
+    - The total ads spend is \\${total_ads_spend:,.2f} and the total payouts are \\${total_payouts:,.2f}, so advertising makes up {ads_share:.2%} of our costs.
+    - The profit, total revenue minus total ads spend and payouts, is \\${kpis['total_profit']:,.2f}, a profit margin of {kpis['profit_margin']:.2f}% of total revenue.
     - Based on this information, it may be beneficial to analyze our advertising strategies and campaigns to identify areas for optimization or cost reduction, without significantly impacting revenue.
     - Additionally, comparing the profit margin of the company to industry standards or competitors may provide insights into areas for improvement.
     """)
 
 with col8:
-    # Calculate total profit
-    total_profit = total_revenue - total_payouts - total_ads_spend
-    # Calculate average profit for each install.
-    avg_profit = total_profit / total_installs
+    # Total profit and average profit for each install.
+    total_profit = kpis['total_profit']
+    avg_profit = kpis['avg_profit_per_install']
     # Add total profit to the total dataframe
     total['total_profit'] = total_profit
     # Visualize total revenue, total payouts, total ads spend, and total profit in a pie chart with a hole in the middle.
     # Gather all values of total dataframe in a new dataframe in 1 column.
     total_values = total.melt(value_vars=['total_ads_spend', 'total_payouts', 'total_revenue', 'total_profit'], value_name='value')
     
-    # Calculate profit margin.
-    profit_margin = (total_profit / total_revenue) * 100
+    # Profit margin in %.
+    profit_margin = kpis['profit_margin']
     # Visualize total values in a pie chart with a hole in the middle.
     fig_total_values = px.pie(total_values, values='value', names='variable', hole=.3, title='Total Revenue, Payouts, Ads Spend and Profit')
     fig_total_values.update_traces(textposition='inside', textinfo='percent+label')
@@ -295,59 +306,170 @@ with col8:
 
 
 
-    st.markdown("""
-    - The pie chart displays the financial performance of our company for a given time period.
-    - Our company had a total revenue of \\$418,845.29 during this period, and a total profit of $102,448.33.
-    - The chart shows that our company spent $254,075.99 on ads during this period, which represents a significant portion of our expenses.
-    - The chart indicates that our company's total payouts were $62,320.97, which suggests that we have a relatively low level of expenses compared to revenue.
-    - Based on these figures, it appears that our company has a healthy financial position, with a decent amount of profit despite significant ads spend.
+    st.markdown(f"""
+    - The pie chart displays the financial performance of our company for the selected period.
+    - Our company had a total revenue of \\${total_revenue:,.2f} during this period, and a total profit of \\${total_profit:,.2f}.
+    - Ads spend of \\${total_ads_spend:,.2f} and payouts of \\${total_payouts:,.2f} correspond to {ads_share:.2%} and {1 - ads_share:.2%} of our costs.
     - To further improve our financial performance, we may want to consider reducing our ads spend or exploring more cost-effective advertising strategies.
     - Additionally, we could consider investing in areas that have shown potential for revenue growth, such as expanding our product offerings or increasing our customer base.
     """)
 
 
+profiling.section("daily")
 col9, col10 = st.columns(2)
 with col9:
-    # Visualize daily revenue, daily payouts, and daily ads_spend as a line chart using plotly express
-    fig_daily = go.Figure()
-    fig_daily.add_trace(go.Scatter(x=revenue_by_date['event_date'], y=revenue_by_date['daily_revenue'], mode='lines', name='Daily Revenue', marker_color='#4d79ff'))
-    fig_daily.add_trace(go.Scatter(x=payouts_by_date['event_date'], y=payouts_by_date['daily_payouts'], mode='lines', name='Daily Payouts',  marker_color='#ff4d4d'))
-    fig_daily.add_trace(go.Scatter(x=ads_by_date['event_date'], y=ads_by_date['daily_ads_spend'], mode='lines', name='Daily Ads Spend', marker_color='#ffbb33'))
-    fig_daily.update_layout(title='Daily Revenue, Payouts and Ads Spend', yaxis_title='USD ($)',  xaxis_title='Date', showlegend=True)
-    st.plotly_chart(fig_daily)
-
-    st.markdown("""
-    - Based on the trends in the chart, we can see that our daily revenue and daily ads spend follow a similar trend, which indicates that advertising is likely a significant driver of revenue for our company. We can focus on optimizing our advertising strategy to maximize the return on our ads spend by analyzing the performance of different ad channels, testing different ad creatives, or targeting different audience segments.
-    - The decrease in revenue and ads spend after day 40 may indicate a shift in market conditions or a change in consumer behavior. We can conduct market research to better understand our target audience and identify any changes in their preferences or needs.
-    - The consistent daily payouts suggest that we have regular expenses or payouts that need to be made. We can review our expenses and identify areas where we can reduce costs to improve profitability.
+    def build_fig_daily():
+        # Visualize daily revenue, daily payouts, and daily ads_spend as a line chart
+        fig_daily = go.Figure()
+        fig_daily.add_trace(charts.scatter(x=revenue_by_date['event_date'], y=revenue_by_date['daily_revenue'], mode='lines', name='Daily Revenue', marker_color='#4d79ff'))
+        fig_daily.add_trace(charts.scatter(x=payouts_by_date['event_date'], y=payouts_by_date['daily_payouts'], mode='lines', name='Daily Payouts',  marker_color='#ff4d4d'))
+        fig_daily.add_trace(charts.scatter(x=ads_by_date['event_date'], y=ads_by_date['daily_ads_spend'], mode='lines', name='Daily Ads Spend', marker_color='#ffbb33'))
+        fig_daily.update_layout(title='Daily Revenue, Payouts and Ads Spend', yaxis_title='USD ($)',  xaxis_title='Date', showlegend=True)
+        return fig_daily
+    fig_daily = charts.figure("fig_daily", filters, build_fig_daily)
+    charts.plotly_chart(fig_daily)
+
+    # Correlation of daily revenue with ads spend, matched on event_date.
+    daily_all = metrics.daily(filters)
+    revenue_ads_corr = daily_all['daily_revenue'].corr(daily_all['daily_ads_spend'])
+    st.markdown(f"""
+    - Daily revenue and daily ads spend have a correlation of {revenue_ads_corr:.2f}, {'so advertising is likely a significant driver of revenue for our company' if revenue_ads_corr >= 0.5 else 'so day-to-day revenue does not simply follow ads spend'}. We can focus on optimizing our advertising strategy to maximize the return on our ads spend by analyzing the performance of different ad channels, testing different ad creatives, or targeting different audience segments.
+    - The spikes, dips and shifts of each series are listed with its chart above; shifts in revenue and ads spend may indicate changes in market conditions or consumer behavior.
     - By regularly analyzing and monitoring these variables, we can make data-driven decisions about our business strategy and marketing efforts, ultimately leading to increased profitability and growth.
     """)
 
+profiling.section("daily_profit")
 with col10:
-    # Calculate daily profit by date and add it to the revenue_by_date dataframe as a new column called daily_profit.
-    revenue_by_date['daily_profit'] = revenue_by_date['daily_revenue'] - payouts_by_date['daily_payouts'] - ads_by_date['daily_ads_spend']
+    # Daily profit by date, with the three daily series matched on event_date.
+    profit_by_date = metrics.daily_profit(filters)
+    profiling.rows(len(profit_by_date))
     # Calculate total profit.
-    total_profit = revenue_by_date['daily_profit'].sum()
+    total_profit = profit_by_date['daily_profit'].sum()
     # Calculate average daily profit.
-    avg_profit = revenue_by_date['daily_profit'].mean()
-    # Visualize daily profit as a line chart using plotly express
-    fig_daily_profit = px.line(revenue_by_date, x='event_date', y='daily_profit', title='Daily Profit', color_discrete_sequence=['#00cc96'], labels={'event_date': 'Date', 'daily_profit': 'USD ($)'})
-    # Add annotation to show total profit on top left corner.
-    fig_daily_profit.add_annotation(x=0, y=1, xref='paper', yref='paper', xanchor='left', yanchor='bottom', text=f"Total Profit: ${total_profit:,.2f}", showarrow=False, font=dict(size=14, color='black', family='Arial'))
-    # Add annotation to show average daily profit on top right corner.
-    fig_daily_profit.add_annotation(x=1, y=1, xref='paper', yref='paper', xanchor='right', yanchor='bottom', text=f"Average Daily Profit: ${avg_profit:,.2f}", showarrow=False, font=dict(size=14, color='black', family='Arial'))
-    fig_daily_profit.add_hline(y=0)
-    st.plotly_chart(fig_daily_profit)
+    avg_profit = profit_by_date['daily_profit'].mean()
+    def build_fig_daily_profit():
+        # Visualize daily profit as a line chart using plotly express
+        fig_daily_profit = charts.line(profit_by_date, x='event_date', y='daily_profit', title='Daily Profit', color_discrete_sequence=['#00cc96'], labels={'event_date': 'Date', 'daily_profit': 'USD ($)'})
+        # Add annotation to show total profit on top left corner.
+        fig_daily_profit.add_annotation(x=0, y=1, xref='paper', yref='paper', xanchor='left', yanchor='bottom', text=f"Total Profit: ${total_profit:,.2f}", showarrow=False, font=dict(size=14, color='black', family='Arial'))
+        # Add annotation to show average daily profit on top right corner.
+        fig_daily_profit.add_annotation(x=1, y=1, xref='paper', yref='paper', xanchor='right', yanchor='bottom', text=f"Average Daily Profit: ${avg_profit:,.2f}", showarrow=False, font=dict(size=14, color='black', family='Arial'))
+        fig_daily_profit.add_hline(y=0)
+        return fig_daily_profit
+    fig_daily_profit = charts.figure("fig_daily_profit", filters, build_fig_daily_profit)
+    charts.plotly_chart(fig_daily_profit)
+
+    st.markdown(insight_bullets('profit', [
+        "It's important to investigate the causes of these fluctuations and identify strategies to improve profitability.",
+        "By identifying patterns or trends in the fluctuations, we can make more informed business decisions in the future.",
+    ]))
+
+# UNIT ECONOMICS BY SEGMENT
+profiling.section("unit_economics")
+st.header("💰 Unit Economics by Segment")
+# Revenue and payouts are joined to their install's country, app and network; ads spend is matched on the same keys.
+segment_by = st.multiselect('Break down by', ['country_id', 'app_id', 'network_id'], default=['country_id', 'network_id'])
+if segment_by:
+    economics = data.unit_economics(segment_by, filters).copy()
+    profiling.rows(len(economics))
+    economics['segment'] = economics[segment_by].astype(str).agg(' / '.join, axis=1)
+
+    col15, col16 = st.columns(2)
+    with col15:
+        # Visualize lifetime value and payout per install of each segment in a grouped bar chart.
+        fig_ltv = go.Figure(data=[
+            go.Bar(name='LTV', x=economics['segment'], y=economics['ltv'], marker_color='#4d79ff'),
+            go.Bar(name='Payout Per Install', x=economics['segment'], y=economics['payout_per_install'], marker_color='#ff4d4d'),
+        ])
+        fig_ltv.update_layout(title='LTV and Payout Per Install by ' + ' / '.join(segment_by), yaxis_title='USD ($)', barmode='group')
+        st.plotly_chart(fig_ltv)
+
+    with col16:
+        # Visualize return on ads spend of each segment; segments without ads spend have no ROAS.
+        fig_roas = px.bar(economics.dropna(subset=['roas']), x='segment', y='roas', title='ROAS by ' + ' / '.join(segment_by), labels={'segment': ' / '.join(segment_by), 'roas': 'Revenue per $ of Ads Spend'}, color_discrete_sequence=['#00cc96'])
+        fig_roas.add_hline(y=1)
+        st.plotly_chart(fig_roas)
+
+    st.dataframe(economics.drop(columns='segment'), use_container_width=True)
 
     st.markdown("""
-    - The chart shows an initial upward trend in profit, followed by a sharp decline and continued fluctuations at a lower level.
-    - The reasons behind the initial upward trend may include successful marketing campaigns, new product launches, or other factors that contributed to increased sales.
-    - The reasons for the decline in profit and continued fluctuations may include changes in the market or economic conditions, increased competition, or internal issues such as operational inefficiencies or supply chain problems.
-    - It's important to investigate the causes of these fluctuations and identify strategies to improve profitability.
-    - We may want to analyze any changes we made in response to the decline in profit and determine their impact on profitability.
-    - By identifying patterns or trends in the fluctuations, we can make more informed business decisions in the future.
+    - LTV is the revenue earned per install of a segment over the whole period, and payout per install is what we paid out per install of it.
+    - ROAS is the revenue of a segment for each dollar of ads spend on it; segments below the line at 1 earned less than was spent to acquire them.
+    - Revenue from installs that are not in the installs data is shown under id -1.
     """)
 
+# INSTALL COHORTS
+profiling.section("cohorts")
+st.header("⏳ Install Cohorts and Payback")
+# Cumulative revenue and payouts per install by days since install, pooled over all cohorts that reached each age.
+# Cohorts follow the country, app and date filters: the date range selects the install dates of the cohorts.
+cohort_curve = data.cohort_curves(filter_countries, filter_apps, start=start_date, end=end_date)
+profiling.rows(len(cohort_curve))
+# Cost per install of the selection: ads spend over installs, matched on country and app.
+selection = data.unit_economics(['country_id', 'app_id'], slicer.Filters(start_date, end_date, filter_countries, filter_apps))
+cost_per_install = selection['ads_spend'].sum() / max(selection['installs'].sum(), 1)
+payback = cohorts.payback_day(cohort_curve, cost_per_install)
+
+col17, col18 = st.columns(2)
+with col17:
+    # Visualize the cumulative revenue, payouts and net revenue per install against the cost per install.
+    fig_payback = go.Figure()
+    fig_payback.add_trace(go.Scatter(x=cohort_curve.index, y=cohort_curve['revenue_per_install'], mode='lines', name='Revenue Per Install', marker_color='#4d79ff'))
+    fig_payback.add_trace(go.Scatter(x=cohort_curve.index, y=cohort_curve['payouts_per_install'], mode='lines', name='Payouts Per Install', marker_color='#ff4d4d'))
+    fig_payback.add_trace(go.Scatter(x=cohort_curve.index, y=cohort_curve['net_per_install'], mode='lines', name='Net Revenue Per Install', marker_color='#00cc96'))
+    fig_payback.add_hline(y=cost_per_install, line_dash='dash', line_color='#ffbb33', annotation_text=f"Cost Per Install: ${cost_per_install:,.2f}")
+    fig_payback.update_layout(title='Cumulative Value Per Install by Days Since Install', xaxis_title='Days Since Install', yaxis_title='USD ($)', showlegend=True)
+    # Add payback day annotation to top left of chart
+    fig_payback.add_annotation(x=0, y=1, xref='paper', yref='paper', xanchor='left', yanchor='bottom', text=f"Payback: day {payback}" if payback is not None else f"No payback within {cohorts.MAX_AGE} days", showarrow=False, font=dict(size=14, color='black', family='Arial'))
+    st.plotly_chart(fig_payback)
+
+with col18:
+    # Visualize revenue per install of each monthly install cohort by days since install in a heatmap.
+    monthly = data.cohort_curves(filter_countries, filter_apps, freq='M', start=start_date, end=end_date)['revenue_per_install'].unstack('age')
+    monthly.index = monthly.index.strftime('%Y-%m')
+    fig_cohorts = px.imshow(monthly, aspect='auto', color_continuous_scale='Blues', title='Cumulative Revenue Per Install by Monthly Cohort', labels={'x': 'Days Since Install', 'y': 'Install Month', 'color': 'USD ($)'})
+    st.plotly_chart(fig_cohorts)
+
+st.markdown(f"""
+- Each curve pools all install cohorts that are old enough to have reached that day, so recent cohorts do not pull the curves down.
+- Net revenue per install is revenue minus payouts per install; the selection pays back its cost per install on the first day the net curve crosses the dashed line.
+- Empty cells in the heatmap are ages that a monthly cohort has not reached yet. Only the first {cohorts.MAX_AGE} days after install are counted.
+- Cohorts follow the date, country and app filters; the network filter does not apply to them.
+""")
+
+# UNIQUE INSTALLS, PAYERS AND EARNERS
+profiling.section("uniques")
+st.header("👥 Unique Installs, Payers and Earners")
+# Distinct installs per period, merged from per-day, country and app sketches; exact for small selections.
+period = st.selectbox('Period', ['Daily', 'Weekly'], index=1)
+unique_filters = slicer.Filters(start_date, end_date, filter_countries, filter_apps)
+unique_total = data.unique_installs(unique_filters).iloc[0]
+unique_periods = data.unique_installs(unique_filters, freq=period[0]).reset_index()
+profiling.rows(len(unique_periods))
+
+col19, col20 = st.columns(2)
+with col19:
+    # Visualize the unique payers and earners of each period.
+    fig_unique = go.Figure()
+    fig_unique.add_trace(charts.scatter(unique_periods['period'], unique_periods['earners'], mode='lines', name='Earners', marker_color='#4d79ff'))
+    fig_unique.add_trace(charts.scatter(unique_periods['period'], unique_periods['payers'], mode='lines', name='Payers', marker_color='#ff4d4d'))
+    fig_unique.update_layout(title=f'{period} Unique Payers and Earners', xaxis_title='Date', yaxis_title='Installs', showlegend=True)
+    st.plotly_chart(fig_unique)
+
+with col20:
+    # Show the unique counts of the whole selection with their standard errors, and the payer conversion.
+    for name in ['installs', 'payers', 'earners']:
+        error = unique_total[f'{name}_std_error']
+        st.metric(f'Unique {name.capitalize()}', f"{unique_total[name]:,.0f}" + (f" ± {error:,.0f}" if error else ""))
+    st.metric('Payer Conversion', f"{unique_total['payer_conversion']:.2%}")
+
+st.markdown(f"""
+- Payers are installs with payouts and earners are installs with revenue in the period; installs are counted on their install date.
+- Counts are exact when the selected days, countries and apps hold at most {uniques.EXACT_LIMIT:,} installs; larger ones are estimated from HyperLogLog sketches with a standard error of {sketch.relative_error(uniques.PRECISION):.2%}, shown as ±.
+- Payer conversion is the share of the selection's installs that ever had a payout, counted exactly.
+- Unique counts follow the date, country and app filters; the network filter does not apply to them.
+""")
+
 st.header("📊 SWOT Analysis")
 col11, col12 = st.columns(2)
 
@@ -377,6 +499,7 @@ with col12:
     - Heavy reliance on one country for a majority of installs could leave the company vulnerable to political or economic changes in that country.
     """)
 
+profiling.section("conclusions")
 col13, col14 = st.columns(2)
 
 with col13:
@@ -392,9 +515,12 @@ with col14:
     st.markdown("""
     ## ➡️ Next Steps
     - Conduct a deeper analysis of external factors that may be influencing ad spend and daily installs, such as seasonality, industry trends, and changes in consumer behavior.
-    - Explore the reasons for the decline in daily installs after the peak in mid-November and identify potential areas for improvement.
+    - Explore the reasons for the spikes, dips and shifts flagged in each daily series and identify potential areas for improvement.
     - Investigate why country_id=1 is the most popular country for installs and whether there are specific factors contributing to this trend.
     - Identify opportunities for growth and improvement among apps with smaller percentages of installs.
     - Conduct further analysis to identify factors driving fluctuations in the payout amounts and to assess the long-term sustainability of the company's payout strategy.
     - Continuously monitor daily installs, ad spend, payouts, and revenue to identify trends and patterns that can inform strategic decision-making.
     """)
+
+profiling.end_run()
+startup.mark("complete")
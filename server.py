@@ -0,0 +1,177 @@
+"""Local HTTP service for the report's metrics.
+
+    python server.py [port]
+
+Serves the numbers of metrics.py without rendering the report:
+
+    GET /kpis                  totals, profit, margin and averages
+    GET /daily                 every daily series, one row per date
+    GET /daily/<series>        one of ads_spend, installs, payouts, revenue, profit
+    GET /segments              the country, app and network ids that can be filtered on
+    GET /anomalies/<series>    spikes and dips of every country × app series
+    GET /health                cache statistics
+
+Filters are query parameters: ``start`` and ``end`` (YYYY-MM-DD) and
+``country``, ``app`` and ``network`` (repeated or comma separated ids);
+networks do not apply to ``/anomalies``.
+``format=arrow`` returns an Arrow IPC stream instead of JSON.
+
+Connections are handled by asyncio; the metrics are computed on a pool of
+``JUSTDICE_API_THREADS`` threads (default 8), all reading the one in-memory
+dataset that data.py caches for the process, so concurrent requests never
+re-read the event files. The service binds to ``JUSTDICE_API_HOST``
+(default 127.0.0.1) and ``JUSTDICE_API_PORT`` (default 8765).
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+import pyarrow as pa
+
+import anomalies
+import data
+import metrics
+import slicer
+
+HOST = os.environ.get("JUSTDICE_API_HOST", "127.0.0.1")
+PORT = int(os.environ.get("JUSTDICE_API_PORT", "8765"))
+THREADS = int(os.environ.get("JUSTDICE_API_THREADS", "8"))
+
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+
+log = logging.getLogger(__name__)
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class NotFound(LookupError):
+    pass
+
+
+def parse_filters(query):
+    """slicer.Filters from parsed query parameters."""
+    def ids(name):
+        try:
+            return tuple(int(v) for value in query.get(name, []) for v in value.split(",") if v)
+        except ValueError:
+            raise BadRequest(f"{name} must be integer ids") from None
+
+    def date(name):
+        if name not in query:
+            return None
+        try:
+            return pd.Timestamp(query[name][-1])
+        except ValueError:
+            raise BadRequest(f"{name} must be a date (YYYY-MM-DD)") from None
+
+    start, end = date("start"), date("end")
+    if start is not None and end is not None and start > end:
+        raise BadRequest("start must not be after end")
+    return slicer.Filters(start, end, ids("country"), ids("app"), ids("network"))
+
+
+def daily_series(name: str, filters):
+    if name == "profit":
+        return metrics.daily_profit(filters)
+    if name not in metrics.SERIES:
+        raise NotFound(name)
+    function, _ = metrics.SERIES[name]
+    return function(filters)
+
+
+def segment_anomalies(name: str, filters):
+    if name not in anomalies.SERIES:
+        raise NotFound(name)
+    return anomalies.select(data.segment_anomalies(name).anomalies(), filters)
+
+
+def route(path: str, query):
+    """The result of a GET of ``path``: a DataFrame or a JSON-serializable dict. NotFound for unknown paths."""
+    parts = [part for part in path.split("/") if part]
+    if parts == ["health"]:
+        return {"status": "ok", "cache": data.cache.stats()}
+    if parts == ["segments"]:
+        return data.segment_values()
+    filters = parse_filters(query)
+    if parts == ["kpis"]:
+        return metrics.kpis(filters)
+    if parts == ["daily"]:
+        return metrics.daily(filters)
+    if len(parts) == 2 and parts[0] == "daily":
+        return daily_series(parts[1], filters)
+    if len(parts) == 2 and parts[0] == "anomalies":
+        return segment_anomalies(parts[1], filters)
+    raise NotFound(path)
+
+
+def encode(result, fmt: str):
+    """(content type, body) of a result in ``fmt`` ("json" or "arrow")."""
+    if fmt == "arrow":
+        table = pa.Table.from_pandas(result, preserve_index=False) if isinstance(result, pd.DataFrame) \
+            else pa.Table.from_pylist([result])
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return ARROW_TYPE, sink.getvalue().to_pybytes()
+    if fmt != "json":
+        raise BadRequest("format must be json or arrow")
+    if isinstance(result, pd.DataFrame):
+        if 'event_date' in result:
+            result = result.assign(event_date=result['event_date'].dt.strftime('%Y-%m-%d'))
+        return "application/json", result.to_json(orient="records").encode()
+    return "application/json", json.dumps(result, default=float).encode()
+
+
+def handle(target: str):
+    """(status, content type, body) of a GET of ``target``; runs on the worker pool."""
+    url = urlsplit(target)
+    query = parse_qs(url.query)
+    try:
+        return HTTPStatus.OK, *encode(route(url.path, query), query.get("format", ["json"])[-1])
+    except NotFound:
+        return HTTPStatus.NOT_FOUND, "application/json", json.dumps({"error": f"no such path: {url.path}"}).encode()
+    except BadRequest as e:
+        return HTTPStatus.BAD_REQUEST, "application/json", json.dumps({"error": str(e)}).encode()
+    except Exception:
+        log.exception("GET %s failed", target)
+        return HTTPStatus.INTERNAL_SERVER_ERROR, "application/json", b'{"error": "internal error"}'
+
+
+async def serve_connection(reader, writer, pool):
+    try:
+        request = await reader.readuntil(b"\r\n\r\n")
+        method, target, _ = request.split(b"\r\n", 1)[0].decode("latin-1").split(" ", 2)
+        if method != "GET":
+            status, content_type, body = HTTPStatus.METHOD_NOT_ALLOWED, "application/json", b'{"error": "GET only"}'
+        else:
+            status, content_type, body = await asyncio.get_running_loop().run_in_executor(pool, handle, target)
+        writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, ConnectionError):
+        pass  # malformed request or client gone
+    finally:
+        writer.close()
+
+
+async def serve(host: str = HOST, port: int = PORT, threads: int = THREADS):
+    with ThreadPoolExecutor(threads, thread_name_prefix="metrics") as pool:
+        # Build the cube index before accepting requests, so the first ones do not all wait on it.
+        await asyncio.get_running_loop().run_in_executor(pool, data.cube_index)
+        server = await asyncio.start_server(lambda r, w: serve_connection(r, w, pool), host, port)
+        log.info("serving metrics on http://%s:%d", host, port)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(serve(port=int(sys.argv[1]) if len(sys.argv) > 1 else PORT))
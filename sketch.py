@@ -0,0 +1,62 @@
+"""HyperLogLog sketches for distinct install counts.
+
+A sketch is a row of ``2**precision`` uint8 registers; many sketches are kept
+as the rows of one 2-D array so that whole groups of them can be updated,
+merged (element-wise max) and estimated with vectorized numpy operations.
+Install keys are hashed with splitmix64 before they reach the registers.
+"""
+import numpy as np
+
+DEFAULT_PRECISION = 10
+
+
+def hash64(values):
+    """splitmix64 finalizer: a well-mixed uint64 hash of integer ``values``."""
+    h = np.asarray(values).astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def _bit_length(x):
+    # Bit length of uint64 values, exact because each 32-bit half fits a float64 mantissa.
+    hi = (x >> np.uint64(32)).astype(np.float64)
+    lo = (x & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(hi > 0, np.frexp(hi)[1] + 32, np.frexp(lo)[1])
+
+
+def empty(n: int, precision: int = DEFAULT_PRECISION):
+    return np.zeros((n, 1 << precision), dtype=np.uint8)
+
+
+def update(registers, rows, values):
+    """Add ``values`` (install keys) to the sketches ``registers[rows]`` in place."""
+    precision = int(registers.shape[1]).bit_length() - 1
+    h = hash64(values)
+    bucket = (h >> np.uint64(64 - precision)).astype(np.intp)
+    rest = h & np.uint64((1 << (64 - precision)) - 1)
+    rank = (64 - precision - _bit_length(rest) + 1).astype(np.uint8)
+    np.maximum.at(registers, (np.asarray(rows, dtype=np.intp), bucket), rank)
+    return registers
+
+
+def merge(a, b):
+    """Union of two equally sized sets of sketches."""
+    return np.maximum(a, b)
+
+
+def estimate(registers):
+    """Estimated distinct count of every sketch (row) in ``registers``."""
+    registers = np.atleast_2d(registers)
+    m = registers.shape[1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.exp2(-registers.astype(np.float64)).sum(axis=1)
+    zeros = (registers == 0).sum(axis=1)
+    # Linear counting is more accurate while many registers are still empty.
+    linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+def relative_error(precision: int = DEFAULT_PRECISION):
+    """Standard error of the estimate, relative to the true count."""
+    return 1.04 / np.sqrt(1 << precision)
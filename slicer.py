@@ -0,0 +1,104 @@
+"""Date-sorted, indexed view of the cube for filtered rollups.
+
+The report's filters (a date range and sets of country, app and network ids)
+are applied to a ``CubeIndex`` rather than by regrouping a frame: cube rows
+are sorted by date with an offset per day, so a date range is one slice, and
+every segment column is stored as small integer codes, so a set of ids is one
+``np.isin`` over the codes of that slice. A filtered rollup is then a
+``np.bincount`` over the selected rows.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import cube
+from cohorts import day_numbers
+
+SEGMENTS = ['country_id', 'app_id', 'network_id']
+
+Filters = namedtuple("Filters", ["start", "end", "countries", "apps", "networks"], defaults=[None, None, (), (), ()])
+
+
+def normalize(filters=None):
+    """Filters with dates as Timestamps and id sets as sorted tuples, usable as a cache key."""
+    if filters is None:
+        return Filters()
+    start = None if filters.start is None else pd.Timestamp(filters.start)
+    end = None if filters.end is None else pd.Timestamp(filters.end)
+    return Filters(start, end, tuple(sorted(filters.countries)), tuple(sorted(filters.apps)),
+                   tuple(sorted(filters.networks)))
+
+
+def is_active(filters):
+    return filters is not None and normalize(filters) != Filters()
+
+
+class CubeIndex:
+    """The cube sorted by date, with per-day row offsets and the segment columns as codes."""
+
+    def __init__(self, df: pd.DataFrame):
+        df = df.sort_values('event_date', kind='stable', ignore_index=True)
+        days = day_numbers(df['event_date'])
+        self.first_day = int(days[0]) if len(days) else 0
+        self.n_days = int(days[-1]) - self.first_day + 1 if len(days) else 0
+        # Rows of day d (counted from first_day) are offsets[d]:offsets[d + 1].
+        self.offsets = np.searchsorted(days, self.first_day + np.arange(self.n_days + 1))
+        self.day = (days - self.first_day).astype(np.int64)
+        self.measures = {column: df[column].to_numpy(dtype=np.float64) for column in cube.MEASURES}
+        self.codes, self.values = {}, {}
+        for dim in SEGMENTS:
+            codes, values = pd.factorize(df[dim], sort=True)
+            self.codes[dim], self.values[dim] = codes.astype(np.int32), np.asarray(values)
+
+    @property
+    def nbytes(self):
+        arrays = [self.offsets, self.day, *self.measures.values(), *self.codes.values(), *self.values.values()]
+        return sum(a.nbytes for a in arrays)
+
+    def dates(self):
+        return pd.to_datetime(self.first_day + np.arange(self.n_days), unit='D')
+
+    def select(self, filters=None):
+        """Rows matching ``filters``: a (start, stop) slice and a mask over it (None for all)."""
+        filters = normalize(filters)
+        first = 0 if filters.start is None else day_numbers([filters.start])[0] - self.first_day
+        last = self.n_days - 1 if filters.end is None else day_numbers([filters.end])[0] - self.first_day
+        start = self.offsets[np.clip(first, 0, self.n_days)]
+        # An end before the start selects no rows.
+        stop = max(start, self.offsets[np.clip(last + 1, 0, self.n_days)])
+        mask = None
+        for dim, chosen in zip(SEGMENTS, [filters.countries, filters.apps, filters.networks]):
+            if not chosen:
+                continue
+            rows = np.isin(self.codes[dim][start:stop], np.flatnonzero(np.isin(self.values[dim], chosen)))
+            mask = rows if mask is None else mask & rows
+        return start, stop, mask
+
+    def _take(self, array, selection):
+        start, stop, mask = selection
+        return array[start:stop] if mask is None else array[start:stop][mask]
+
+    def daily(self, measure: str, rows: str, filters=None):
+        """Daily sums of ``measure`` over the selected rows, for the days with ``rows`` > 0."""
+        selection = self.select(filters)
+        day = self._take(self.day, selection)
+        sums = np.bincount(day, weights=self._take(self.measures[measure], selection), minlength=self.n_days)
+        counts = np.bincount(day, weights=self._take(self.measures[rows], selection), minlength=self.n_days)
+        present = counts > 0
+        return pd.Series(sums[present], index=self.dates()[present], name=measure).rename_axis('event_date')
+
+    def totals_by(self, dims, measures, filters=None):
+        """Sums of ``measures`` over the selected rows for each combination of ``dims`` present in them."""
+        selection = self.select(filters)
+        sizes = [len(self.values[dim]) for dim in dims]
+        flat = np.zeros(selection[1] - selection[0] if selection[2] is None else selection[2].sum(), dtype=np.int64)
+        for dim, size in zip(dims, sizes):
+            flat = flat * size + self._take(self.codes[dim], selection)
+        n = int(np.prod(sizes))
+        present = np.bincount(flat, minlength=n) > 0
+        positions = np.unravel_index(np.flatnonzero(present), sizes)
+        df = pd.DataFrame({dim: self.values[dim][pos] for dim, pos in zip(dims, positions)})
+        for measure in measures:
+            df[measure] = np.bincount(flat, weights=self._take(self.measures[measure], selection), minlength=n)[present]
+        return df
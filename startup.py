@@ -0,0 +1,76 @@
+"""Startup-time measurement of the report.
+
+    python startup.py [runs]
+
+report.py calls ``begin()`` before its imports and ``mark(stage)`` after
+them ("imports"), once the header is on the page ("first_paint") and at the
+end of the script ("complete"). Every stage is timed in milliseconds since
+``begin()``, per script run, and logged when the run completes (to
+``JUSTDICE_PROFILE_LOG``, see profiling.py); a first paint slower than
+``JUSTDICE_STARTUP_BUDGET_MS`` (default 2000) is logged as a warning. Only
+the first run of a process pays for the imports, so that is the run the
+budget is meant for.
+
+Run as a script it executes report.py ``runs`` times (default 3), each in a
+fresh interpreter in Streamlit's bare mode (no server), prints the timings
+of every run and exits with status 1 if the best first paint is over budget.
+"""
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import profiling
+
+BUDGET_MS = float(os.environ.get("JUSTDICE_STARTUP_BUDGET_MS", "2000"))
+STAGES = ["imports", "first_paint", "complete"]
+REPORT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "report.py")
+
+log = logging.getLogger(__name__)
+profiling.configure_log(log)
+_run = profiling.run_state  # per-thread, like the section timings
+
+
+def begin():
+    _run.start = time.perf_counter()
+    _run.timings = {}
+
+
+def mark(stage: str):
+    """Record the time since ``begin()`` at which ``stage`` was reached in this run."""
+    if getattr(_run, "start", None) is None:
+        return
+    _run.timings[stage] = round((time.perf_counter() - _run.start) * 1000, 1)
+    if stage == STAGES[-1]:
+        over = _run.timings.get("first_paint", 0) > BUDGET_MS
+        log.log(logging.WARNING if over else logging.INFO, "report run (ms): %s, first paint budget %.0f",
+                json.dumps(_run.timings), BUDGET_MS)
+
+
+def timings():
+    """Stage timings of the current thread's latest run, in ms."""
+    return dict(getattr(_run, "timings", {}))
+
+
+def measure():
+    """Run report.py in a fresh interpreter and return its stage timings plus the total process time."""
+    code = ("import json, runpy, startup; runpy.run_path(startup.REPORT, run_name='__main__'); "
+            "print('\\n' + json.dumps(startup.timings()))")
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(REPORT), capture_output=True, text=True,
+                         check=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    result["process"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+if __name__ == "__main__":
+    runs = [measure() for _ in range(int(sys.argv[1]) if len(sys.argv) > 1 else 3)]
+    for i, result in enumerate(runs, 1):
+        print(f"run {i}: " + "  ".join(f"{stage} {result.get(stage, float('nan')):8.1f} ms"
+                                       for stage in STAGES + ["process"]))
+    best = min(result["first_paint"] for result in runs)
+    print(f"best first paint {best:.1f} ms, budget {BUDGET_MS:.0f} ms")
+    sys.exit(1 if best > BUDGET_MS else 0)
@@ -0,0 +1,178 @@
+"""Streaming, chunked aggregation over the ingested event tables.
+
+Tables are read from their Parquet files (the day partitions of
+incremental.py when it keeps the cube) in batches of about
+``JUSTDICE_CHUNK_MB`` of column data (see ingest.py), and every batch is
+folded into running per-key partial aggregates: a compensated sum, count,
+min, max and, optionally, a HyperLogLog sketch of distinct install keys (see
+sketch.py). Partials from different chunks, files or processes merge into
+the same result, so peak memory is one chunk plus the aggregates, however
+large the table is.
+
+Sums use Neumaier compensation across chunks, so they agree with a single
+in-memory ``groupby().sum()`` to well below a cent.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import ingest
+import sketch
+
+
+def row_bytes(schema: pa.Schema, columns=None):
+    """Approximate in-memory size of one row of ``columns``."""
+    size = 0
+    for field in schema:
+        if columns is not None and field.name not in columns:
+            continue
+        type_ = field.type.index_type if pa.types.is_dictionary(field.type) else field.type
+        try:
+            size += max(type_.bit_width // 8, 1)
+        except ValueError:
+            size += 32  # variable width, e.g. strings
+    return max(size, 1)
+
+
+def chunk_rows(schema: pa.Schema, columns=None, chunk_mb=None):
+    chunk_mb = ingest.CHUNK_MB if chunk_mb is None else chunk_mb
+    return max(1024, int(chunk_mb * 1024 * 1024 / row_bytes(schema, columns)))
+
+
+def table_paths(table: str):
+    """Parquet files of an ingested table: its day partitions while incremental.py keeps the cube, else the full table."""
+    import incremental  # incremental imports cube, which imports this module
+    return incremental.partition_paths(table) if incremental.enabled() else [ingest.parquet_path(table)]
+
+
+def read(table: str, columns):
+    """``columns`` of a whole ingested table, from the same files as chunks()."""
+    paths = table_paths(table)
+    if not paths:
+        return ingest.SCHEMAS[table].empty_table().select(columns).to_pandas(date_as_object=False)
+    return pq.read_table(paths, columns=columns, memory_map=True).to_pandas(date_as_object=False)
+
+
+def chunks(table: str, columns, chunk_mb=None, parts=None):
+    """Yield ``columns`` of an ingested table as DataFrames of bounded size.
+
+    ``parts`` limits the scan to some (path, row_groups) pairs of its
+    table_paths(), as split by parallel.slices(); by default every file is
+    read whole.
+    """
+    parts = [(path, None) for path in table_paths(table)] if parts is None else parts
+    for path, row_groups in parts:
+        f = pq.ParquetFile(path, memory_map=True)
+        batch_size = chunk_rows(f.schema_arrow, columns, chunk_mb)
+        for batch in f.iter_batches(batch_size=batch_size, row_groups=row_groups, columns=columns):
+            yield batch.to_pandas(date_as_object=False)
+
+
+class Aggregator:
+    """Running per-key sum, count, min, max and distinct count, updated chunk by chunk.
+
+    ``value`` is the column summed (None to only count rows) and ``distinct``
+    the integer column whose distinct values are sketched per key (None for
+    no sketch).
+    """
+
+    def __init__(self, keys, value=None, distinct=None, precision: int = sketch.DEFAULT_PRECISION):
+        self.keys = list(keys)
+        self.value = value
+        self.distinct = distinct
+        self.precision = precision
+        self.index = None  # one entry per key seen, in order of first appearance
+        self.count = np.zeros(0, dtype=np.int64)
+        self.sum = np.zeros(0)
+        self.comp = np.zeros(0)  # Neumaier compensation of self.sum
+        self.min = np.zeros(0)
+        self.max = np.zeros(0)
+        self.registers = sketch.empty(0, precision)
+
+    def __len__(self):
+        return 0 if self.index is None else len(self.index)
+
+    def _positions(self, index):
+        # Position of every key of `index` in self.index, appending keys not seen yet.
+        if self.index is None:
+            self.index = index[:0]
+        positions = self.index.get_indexer(index)
+        new = positions < 0
+        if new.any():
+            positions[new] = np.arange(len(self.index), len(self.index) + new.sum())
+            self.index = self.index.append(index[new])
+            grow = len(self.index) - len(self.count)
+            self.count = np.concatenate([self.count, np.zeros(grow, dtype=np.int64)])
+            self.sum = np.concatenate([self.sum, np.zeros(grow)])
+            self.comp = np.concatenate([self.comp, np.zeros(grow)])
+            self.min = np.concatenate([self.min, np.full(grow, np.inf)])
+            self.max = np.concatenate([self.max, np.full(grow, -np.inf)])
+            if self.distinct is not None:
+                self.registers = np.concatenate([self.registers, sketch.empty(grow, self.precision)])
+        return positions
+
+    def _add(self, positions, values, comp=0.0):
+        # Neumaier summation: keep the low-order bits lost by each addition in self.comp.
+        s = self.sum[positions]
+        t = s + values
+        lost = np.where(np.abs(s) >= np.abs(values), (s - t) + values, (values - t) + s)
+        self.sum[positions] = t
+        self.comp[positions] += lost + comp
+
+    def update(self, chunk: pd.DataFrame):
+        grouped = chunk.groupby(self.keys)
+        if self.value is None:
+            stats = grouped.size().to_frame('size')
+        else:
+            stats = grouped[self.value].agg(['sum', 'size', 'min', 'max'])
+        positions = self._positions(stats.index)
+        self.count[positions] += stats['size'].to_numpy()
+        if self.value is not None:
+            self._add(positions, stats['sum'].to_numpy(dtype=np.float64))
+            self.min[positions] = np.minimum(self.min[positions], stats['min'].to_numpy())
+            self.max[positions] = np.maximum(self.max[positions], stats['max'].to_numpy())
+        if self.distinct is not None:
+            rows = positions[grouped.ngroup().to_numpy()]
+            sketch.update(self.registers, rows, chunk[self.distinct].to_numpy())
+        return self
+
+    def merge(self, other: "Aggregator"):
+        """Fold the partial aggregates of ``other`` (same keys and columns) into this one."""
+        if other.index is None:
+            return self
+        positions = self._positions(other.index)
+        self.count[positions] += other.count
+        self._add(positions, other.sum, other.comp)
+        self.min[positions] = np.minimum(self.min[positions], other.min)
+        self.max[positions] = np.maximum(self.max[positions], other.max)
+        if self.distinct is not None:
+            self.registers[positions] = sketch.merge(self.registers[positions], other.registers)
+        return self
+
+    def result(self):
+        """The aggregates as a DataFrame indexed by ``keys``, sorted by key."""
+        index = self.index
+        if index is None:
+            index = pd.DataFrame(columns=self.keys).groupby(self.keys).size().index
+        df = pd.DataFrame({'count': self.count}, index=index)
+        if self.value is not None:
+            df['sum'] = self.sum + self.comp
+            df['min'] = self.min
+            df['max'] = self.max
+        if self.distinct is not None:
+            df['distinct'] = sketch.estimate(self.registers) if len(df) else np.zeros(0)
+        return df.sort_index()
+
+
+def aggregate(table: str, columns, keys, value=None, distinct=None, prepare=None, chunk_mb=None, parts=None):
+    """Stream ``columns`` of an ingested table through an Aggregator.
+
+    ``prepare`` maps each chunk to the frame that is aggregated, e.g. to
+    derive key columns that are not stored in the table. ``parts``
+    limits the scan to part of the table; see chunks() and parallel.py.
+    """
+    agg = Aggregator(keys, value, distinct)
+    for chunk in chunks(table, columns, chunk_mb, parts):
+        agg.update(chunk if prepare is None else prepare(chunk))
+    return agg
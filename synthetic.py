@@ -0,0 +1,186 @@
+"""Synthetic exports shaped like the 2022 data, at any multiple of its volume.
+
+    python synthetic.py out_dir [scale] [seed]
+
+Writes ``adspend.csv``, ``installs.csv``, ``payouts.csv`` and ``revenue.csv``
+with the columns and formats of the real exports. At scale 1 the tables
+have about as many rows as the 2022 files (12k ads spend, 217k installs,
+52k payouts and 2.6M revenue rows) spread over one year; every row count
+grows linearly with ``scale``. The skew of the real data is kept:
+
+- countries 1 and 109 take most installs and spend;
+- app ids are drawn from a Zipf-like distribution, a few apps dominate;
+- about a third of installs earn revenue, each with many rows, and a smaller
+  share has payouts, all on or after the install date;
+- install ids are 64-character hex strings (hashed install numbers).
+
+Data is generated and written in blocks of days, so memory stays bounded at
+any scale. The same scale and seed give the same files.
+"""
+import os
+import sys
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+import ingest
+import sketch
+
+START = np.datetime64("2022-01-01")
+DAYS = 365
+
+# Rows of the 2022 exports.
+BASE_ROWS = {"ads": 12_000, "installs": 217_000, "payouts": 52_000, "revenue": 2_600_000}
+
+COUNTRIES = np.array([1, 109, 17, 213, 36, 74, 142, 181])
+COUNTRY_WEIGHTS = np.array([0.50, 0.30, 0.06, 0.05, 0.03, 0.03, 0.02, 0.01])
+NETWORKS = np.array([10, 26, 60, 1111, 42, 77])
+NETWORK_WEIGHTS = np.array([0.35, 0.25, 0.20, 0.10, 0.06, 0.04])
+OS_VERSIONS = np.array(["10", "11", "12", "13", "14", "15", "16"])
+OS_WEIGHTS = np.array([0.05, 0.10, 0.20, 0.25, 0.20, 0.15, 0.05])
+APPS_PER_SCALE = 40
+APP_EXPONENT = 1.5
+
+PAYER_SHARE = 1 / 3  # installs with any revenue
+PAYOUT_SHARE = 0.15  # installs with any payout
+MEAN_LAG_DAYS = 20  # days from install to a revenue or payout event
+
+# Mean value_usd of one row in the 2022 data.
+MEAN_VALUE = {"ads": 21.0, "payouts": 1.2, "revenue": 0.16}
+
+# Target revenue rows per generated block.
+BLOCK_ROWS = 1_000_000
+
+COLUMNS = {
+    "ads": ["event_date", "country_id", "network_id", "client_id", "value_usd"],
+    "installs": ["install_id", "country_id", "app_id", "network_id", "event_date", "device_os_version"],
+    "payouts": ["install_id", "event_date", "value_usd"],
+    "revenue": ["install_id", "event_date", "value_usd"],
+}
+
+HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+
+def hex_ids(numbers, seed: int = 0):
+    """64-character lowercase hex ids of install ``numbers``: four splitmix64 hashes each."""
+    numbers = np.asarray(numbers, dtype=np.uint64) * np.uint64(4) + np.uint64(seed) * np.uint64(1 << 40)
+    words = np.stack([sketch.hash64(numbers + np.uint64(i)) for i in range(4)], axis=1)
+    octets = words.astype(">u8").view(np.uint8).reshape(len(numbers), 32)
+    digits = np.stack([HEX_DIGITS[octets >> 4], HEX_DIGITS[octets & 15]], axis=2).reshape(len(numbers), 64)
+    return digits.view("S64").ravel()
+
+
+def apps(scale: float):
+    """App ids and their install weights, heaviest first."""
+    n = max(APPS_PER_SCALE, int(round(APPS_PER_SCALE * scale)))
+    ids = np.random.default_rng(0).choice(np.arange(1, 10 * n), size=n, replace=False).astype(np.int16)
+    weights = 1.0 / np.arange(1, n + 1) ** APP_EXPONENT
+    return ids, weights / weights.sum()
+
+
+def _date_column(days):
+    return pa.array((START + np.asarray(days)).astype("datetime64[D]"), type=pa.date32())
+
+
+def _values(rng, table: str, n: int):
+    # Log-normal with sigma 1, scaled to the table's mean row value.
+    return rng.lognormal(np.log(MEAN_VALUE[table]) - 0.5, 1.0, n)
+
+
+def ads_block(rng, days, app_ids, app_weights, scale: float):
+    """One row per (date, country, network, client) with spend, ~BASE_ROWS["ads"] * scale rows a year."""
+    segments = len(COUNTRIES) * len(NETWORKS) * len(app_ids)
+    weights = (COUNTRY_WEIGHTS[:, None, None] * NETWORK_WEIGHTS[None, :, None] * app_weights[None, None, :]).ravel()
+    per_day = min(segments, max(1, int(round(BASE_ROWS["ads"] * scale / DAYS))))
+    chosen = np.concatenate([rng.choice(segments, per_day, replace=False, p=weights) for _ in days])
+    country, network, app = np.unravel_index(chosen, (len(COUNTRIES), len(NETWORKS), len(app_ids)))
+    return pa.table({
+        "event_date": _date_column(np.repeat(days, per_day)),
+        "country_id": COUNTRIES[country],
+        "network_id": NETWORKS[network],
+        "client_id": app_ids[app],
+        "value_usd": _values(rng, "ads", len(chosen)),
+    })
+
+
+def install_block(rng, days, first_number: int, app_ids, app_weights, scale: float, seed: int):
+    """Installs of ``days`` numbered from ``first_number``, and (ids, install days) for their events."""
+    # Weekends get 20% more installs.
+    weekday = (np.asarray(days) + 5) % 7  # 2022-01-01 was a Saturday
+    expected = BASE_ROWS["installs"] * scale / DAYS * np.where(weekday >= 5, 1.2, 1.0) / (1 + 0.2 * 2 / 7)
+    day = np.repeat(days, rng.poisson(expected))
+    n = len(day)
+    ids = hex_ids(np.arange(first_number, first_number + n), seed)
+    table = pa.table({
+        "install_id": pa.array(ids.astype(str)),
+        "country_id": rng.choice(COUNTRIES, n, p=COUNTRY_WEIGHTS),
+        "app_id": rng.choice(app_ids, n, p=app_weights),
+        "network_id": rng.choice(NETWORKS, n, p=NETWORK_WEIGHTS),
+        "event_date": _date_column(day),
+        "device_os_version": rng.choice(OS_VERSIONS, n, p=OS_WEIGHTS),
+    })
+    return table, ids, day
+
+
+def event_block(rng, table: str, ids, install_day, share: float):
+    """Revenue or payout rows of a block of installs, on or after the install and within the year."""
+    n = len(ids)
+    mean_rows = BASE_ROWS[table] / BASE_ROWS["installs"] / share
+    earning = np.flatnonzero(rng.random(n) < share)
+    # Geometric row counts: most earning installs have a few rows, some have very many.
+    counts = rng.geometric(1 / mean_rows, len(earning))
+    install = np.repeat(earning, counts)
+    day = install_day[install] + rng.geometric(1 / MEAN_LAG_DAYS, len(install)) - 1
+    keep = day < DAYS
+    install, day = install[keep], day[keep]
+    return pa.table({
+        "install_id": pa.array(ids[install].astype(str)),
+        "event_date": _date_column(day),
+        "value_usd": _values(rng, table, len(install)),
+    })
+
+
+def generate(out_dir: str, scale: float = 1.0, seed: int = 0):
+    """Write the four CSVs for ``scale`` times the 2022 volume into ``out_dir``; returns rows per table."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    app_ids, app_weights = apps(scale)
+    rows_per_day = BASE_ROWS["revenue"] * scale / DAYS
+    block_days = max(1, int(BLOCK_ROWS / rows_per_day))
+    files = {table: open(os.path.join(out_dir, ingest.CSV_FILES[table]), "wb") for table in COLUMNS}
+    writers = {}
+    rows = dict.fromkeys(COLUMNS, 0)
+    options = pacsv.WriteOptions(include_header=False, quoting_style="none")
+
+    def write(table, data):
+        if table not in writers:
+            files[table].write((",".join(COLUMNS[table]) + "\n").encode())
+            files[table].flush()
+            writers[table] = pacsv.CSVWriter(files[table], data.schema, write_options=options)
+        writers[table].write_table(data.select(COLUMNS[table]))
+        rows[table] += data.num_rows
+
+    try:
+        for first_day in range(0, DAYS, block_days):
+            days = np.arange(first_day, min(first_day + block_days, DAYS))
+            write("ads", ads_block(rng, days, app_ids, app_weights, scale))
+            installs, ids, install_day = install_block(rng, days, rows["installs"], app_ids, app_weights, scale, seed)
+            write("installs", installs)
+            write("revenue", event_block(rng, "revenue", ids, install_day, PAYER_SHARE))
+            write("payouts", event_block(rng, "payouts", ids, install_day, PAYOUT_SHARE))
+    finally:
+        for writer in writers.values():
+            writer.close()
+        for f in files.values():
+            f.close()
+    return rows
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit(__doc__.split("\n\n")[1])
+    out = sys.argv[1]
+    counts = generate(out, float(sys.argv[2]) if len(sys.argv) > 2 else 1.0, int(sys.argv[3]) if len(sys.argv) > 3 else 0)
+    for table, n in counts.items():
+        print(f"{table}: {n:,} rows -> {os.path.join(out, ingest.CSV_FILES[table])}")
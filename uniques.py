@@ -0,0 +1,214 @@
+"""Distinct installs, payers and earners per date, country and app.
+
+For each of the installs, payouts and revenue tables the build keeps, for
+every (event_date, country_id, app_id) cell with rows, a HyperLogLog sketch
+of the install keys in it (see sketch.py) together with the sorted distinct
+keys themselves, and the same per event_date over all countries and apps,
+which answers selections by date alone. Payouts and revenue rows get the
+country and app of their install (-1 when the install is unknown), as in
+the cube. An install is a *payer* on the days it has payout rows and an
+*earner* on the days it has revenue rows.
+
+The distinct count of any set of cells (a date range, a union of countries
+and apps, a day or a week) is exact when those cells hold at most
+``JUSTDICE_EXACT_DISTINCT`` keys in total (default 100,000), counted from the
+stored keys; otherwise it is the estimate of the union of their sketches,
+which is an element-wise max of the registers. The estimate has a relative
+standard error of ``sketch.relative_error(precision)``: 3.25% at the default
+``JUSTDICE_SKETCH_PRECISION`` of 10, whose sketches take 1 KB per cell, and
+within twice that about 95% of the time. Installs are always counted
+exactly, since every install is in one cell only.
+
+Payer conversion is the share of the installs in a period (by install date)
+that have at least one payout row at any time, also counted exactly.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import cube
+import ingest
+import sketch
+import slicer
+import stream
+from cohorts import day_numbers
+
+EXACT_LIMIT = int(os.environ.get("JUSTDICE_EXACT_DISTINCT", "100000"))
+PRECISION = int(os.environ.get("JUSTDICE_SKETCH_PRECISION", str(sketch.DEFAULT_PRECISION)))
+
+# Column of conversion() with the distinct installs of each table.
+TABLES = {"installs": "installs", "payouts": "payers", "revenue": "earners"}
+
+
+class Cells:
+    """Numbering of (day, country, app) cells, day-major, over the countries and apps of the installs."""
+
+    def __init__(self, lookup):
+        self.countries = np.union1d(lookup['country_id'], [cube.UNKNOWN])
+        self.apps = np.union1d(lookup['app_id'], [cube.UNKNOWN])
+
+    def ids(self, day, country, app):
+        country = np.searchsorted(self.countries, country)
+        app = np.searchsorted(self.apps, app)
+        return (np.asarray(day, dtype=np.int64) * len(self.countries) + country) * len(self.apps) + app
+
+    def split(self, cells):
+        """(day number, country_id, app_id) of ``cells``."""
+        rest, app = np.divmod(cells, len(self.apps))
+        day, country = np.divmod(rest, len(self.countries))
+        return day, self.countries[country], self.apps[app]
+
+
+class Distinct:
+    """Sketches and sorted distinct install keys of every non-empty cell of one table.
+
+    ``day``, ``country`` and ``app`` hold the coordinates of each cell; the
+    daily cells have no country and app. When ``disjoint``, every key is in
+    one cell only, so counts are sums of cell sizes and no sketches are kept.
+    """
+
+    def __init__(self, cells, keys, day, country=None, app=None, disjoint=False, precision: int = PRECISION):
+        # `cells` and `keys`: one entry per distinct (cell, install_key) pair, sorted by cell.
+        self.precision = precision
+        self.cells, starts = np.unique(cells, return_index=True)
+        self.offsets = np.append(starts, len(keys))
+        self.keys = keys
+        self.day, self.country, self.app = day, country, app
+        self.disjoint = disjoint
+        self.registers = None
+        if not disjoint:
+            self.registers = sketch.empty(len(self.cells), precision)
+            sketch.update(self.registers, np.repeat(np.arange(len(self.cells)), np.diff(self.offsets)), keys)
+
+    @property
+    def nbytes(self):
+        arrays = [self.cells, self.offsets, self.keys, self.day, self.country, self.app, self.registers]
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def select(self, filters):
+        """Positions of the cells matching the dates, countries and apps of normalized ``filters``."""
+        mask = np.ones(len(self.cells), dtype=bool)
+        if filters.start is not None:
+            mask &= self.day >= day_numbers([filters.start])[0]
+        if filters.end is not None:
+            mask &= self.day <= day_numbers([filters.end])[0]
+        if filters.countries:
+            mask &= np.isin(self.country, filters.countries)
+        if filters.apps:
+            mask &= np.isin(self.app, filters.apps)
+        return np.flatnonzero(mask)
+
+    def count(self, positions):
+        """(distinct installs, exact?) of the union of the cells at ``positions``."""
+        sizes = self.offsets[positions + 1] - self.offsets[positions]
+        if self.disjoint:
+            return int(sizes.sum()), True
+        if sizes.sum() <= EXACT_LIMIT:
+            keys = np.concatenate([self.keys[self.offsets[p]:self.offsets[p + 1]] for p in positions]) \
+                if len(positions) else self.keys[:0]
+            return len(np.unique(keys)), True
+        return float(sketch.estimate(self.registers[positions].max(axis=0))[0]), False
+
+
+def collect(table: str, lookup, numbering: Cells, n_keys: int, chunk_mb=None):
+    """Sorted distinct (cell, install_key) pairs of one table, packed as ``cell * n_keys + key``."""
+    pairs = []
+    columns = ["install_key", "event_date", "country_id", "app_id"] if table == "installs" else ["install_key", "event_date"]
+    for chunk in stream.chunks(table, columns, chunk_mb):
+        keys = chunk['install_key'].to_numpy().astype(np.int64)
+        if table == "installs":
+            country, app = chunk['country_id'].to_numpy(), chunk['app_id'].to_numpy()
+        else:
+            segments = cube.attribute(keys, lookup)
+            country, app = segments['country_id'], segments['app_id']
+        pairs.append(np.unique(numbering.ids(day_numbers(chunk['event_date']), country, app) * n_keys + keys))
+    return np.unique(np.concatenate(pairs)) if pairs else np.zeros(0, dtype=np.int64)
+
+
+def build(chunk_mb=None):
+    """Per table, {"segments": Distinct, "days": Distinct}; and the ``payer`` flag of every install key."""
+    lookup = cube.install_attribution()
+    numbering = Cells(lookup)
+    # Every install key is below the size of the key dictionary, so a pair packs into one int64 that sorts by cell.
+    n_keys = ingest.read_manifest()["install_ids"]["rows"] + 1
+    days_per_cell = len(numbering.countries) * len(numbering.apps)
+    result = {}
+    for table in TABLES:
+        pairs = collect(table, lookup, numbering, n_keys, chunk_mb)
+        cells, keys = np.divmod(pairs, n_keys)
+        disjoint = table == "installs"
+        segments = Distinct(cells, keys.astype(np.int32), *numbering.split(np.unique(cells)), disjoint=disjoint)
+        days, keys = np.divmod(np.unique(cells // days_per_cell * n_keys + keys), n_keys)
+        del pairs, cells
+        result[table] = {
+            "segments": segments,
+            "days": Distinct(days, keys.astype(np.int32), np.unique(days), disjoint=disjoint),
+        }
+    installs = result["installs"]["days"].keys
+    payer = np.zeros(int(installs.max(initial=-1)) + 1, dtype=bool)
+    paid = result["payouts"]["days"].keys
+    payer[paid[paid < len(payer)]] = True
+    result["payer"] = payer
+    return result
+
+
+def _periods(days, freq):
+    # Start date of the period of each day number: the day itself, or the Monday of its week.
+    dates = pd.to_datetime(days, unit='D')
+    return dates if freq == 'D' else dates.to_period('W').start_time
+
+
+def _cells(distincts, table: str, filters):
+    # Selections by date alone are answered from the daily cells.
+    return distincts[table]["segments" if filters.countries or filters.apps else "days"]
+
+
+def distinct(distincts, table: str, filters=None, freq=None):
+    """Distinct installs of ``table`` in the selection: one row, or one per day (``'D'``) or week (``'W'``).
+
+    Columns: ``unique``, ``exact`` and ``std_error`` (0 for exact counts).
+    Networks do not apply.
+    """
+    filters = slicer.normalize(filters)
+    d = _cells(distincts, table, filters)
+    positions = d.select(filters)
+    if freq is None:
+        groups = [(None, positions)]
+    else:
+        groups = [(period, group.to_numpy()) for period, group in
+                  pd.Series(positions).groupby(_periods(d.day[positions], freq))]
+    rows = []
+    for period, group in groups:
+        unique, exact = d.count(group)
+        rows.append({"period": period, "unique": unique, "exact": exact,
+                     "std_error": 0.0 if exact else unique * sketch.relative_error(d.precision)})
+    df = pd.DataFrame(rows, columns=["period", "unique", "exact", "std_error"])
+    return df.drop(columns="period") if freq is None else df.set_index("period").sort_index()
+
+
+def conversion(distincts, filters=None, freq=None):
+    """Unique installs, payers and earners and the payer conversion of the installs, per period of ``freq``.
+
+    ``payer_conversion`` is the share of the period's installs with any payout row; ``payers`` and
+    ``earners`` are the installs with payout or revenue rows within the period.
+    """
+    frames = {name: distinct(distincts, table, filters, freq) for table, name in TABLES.items()}
+    df = pd.concat({name: frame["unique"] for name, frame in frames.items()}, axis=1)
+    for name, frame in frames.items():
+        df[f"{name}_std_error"] = frame["std_error"]
+    df = df.fillna(0)
+
+    filters = slicer.normalize(filters)
+    d = _cells(distincts, "installs", filters)
+    positions = d.select(filters)
+    # Every install is in exactly one cell, so converted installs add up exactly across cells.
+    paid = np.concatenate([[0], np.cumsum(distincts["payer"][d.keys])])
+    converted = paid[d.offsets[positions + 1]] - paid[d.offsets[positions]]
+    installs = np.diff(d.offsets)[positions]
+    if freq is None:
+        totals = pd.DataFrame({"converted": [converted.sum()], "counted": [installs.sum()]})
+    else:
+        totals = pd.DataFrame({"converted": converted, "counted": installs}).groupby(_periods(d.day[positions], freq)).sum()
+    df["payer_conversion"] = (totals["converted"] / totals["counted"].where(totals["counted"] > 0)).reindex(df.index)
+    return df